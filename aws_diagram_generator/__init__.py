@@ -3,9 +3,7 @@
 AWS Architecture Diagram Generator
 """
 
-from .aws_reader import AWSResourceReader
-from .cf_exporter import CloudFormationImporter, export_cloudformation
-from .diagram_generator import ArchitectureDiagramGenerator
+import importlib
 
 __version__ = '3.0.0'
 __all__ = [
@@ -14,3 +12,26 @@ __all__ = [
     'export_cloudformation',
     'ArchitectureDiagramGenerator',
 ]
+
+# 公開名 -> サブモジュール名。boto3 / diagrams は使われるまで読み込まない
+# （CloudFormation からのインポートだけなら botocore を読み込まずに済む）
+_LAZY_EXPORTS = {
+    'AWSResourceReader': 'aws_reader',
+    'CloudFormationImporter': 'cf_exporter',
+    'export_cloudformation': 'cf_exporter',
+    'ArchitectureDiagramGenerator': 'diagram_generator',
+}
+
+
+def __getattr__(name):
+    """公開クラスを初回参照時に読み込む（PEP 562）"""
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -7,12 +7,62 @@ AWS API からリソースを読み取る
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 class AWSResourceReader:
     """AWS からリソースを読み取るクラス"""
     
-    def __init__(self, region='ap-northeast-1', role_arn=None, external_id=None, session_name='AWSArchitectureDiagramGenerator'):
+    # 並列読み取りの単位: (順に呼ぶ read メソッド名, 読み取り完了後に確定するコレクション属性名)
+    # CloudFront は Load Balancer を参照するため同じグループで後に読む
+    _PARALLEL_READS = (
+        (('read_vpcs',), ('vpcs',)),
+        (('read_subnets',), ('subnets',)),
+        (('read_internet_gateways',), ('internet_gateways',)),
+        (('read_nat_gateways',), ('nat_gateways',)),
+        (('read_security_groups',), ('security_groups',)),
+        (('read_vpc_endpoints',), ('vpc_endpoints',)),
+        (('read_route_tables',), ('route_tables',)),
+        (('read_ec2_instances',), ('ec2_instances',)),
+        (('read_ecs_clusters',), ('ecs_clusters', 'ecs_services')),
+        (('read_eks_clusters',), ('eks_clusters',)),
+        (('read_lambda_functions',), ('lambda_functions',)),
+        (('read_rds_instances',), ('rds_instances',)),
+        (('read_dynamodb_tables',), ('dynamodb_tables',)),
+        (('read_elasticache_clusters',), ('elasticache_clusters',)),
+        (('read_s3_buckets',), ('s3_buckets',)),
+        (('read_efs_filesystems',), ('efs_filesystems',)),
+        (('read_load_balancers', 'read_cloudfront_distributions'),
+         ('load_balancers', 'alb_listeners', 'target_groups', 'cloudfront_distributions')),
+        (('read_sqs_queues',), ('sqs_queues',)),
+        (('read_sns_topics',), ('sns_topics',)),
+        (('read_iam_roles',), ('iam_roles',)),
+        (('read_cloudwatch_log_groups',), ('log_groups',)),
+        (('read_api_gateways',), ('api_gateways',)),
+        (('read_cloudwatch_event_rules',), ('cloudwatch_event_rules',)),
+    )
+    
+    # 1 ページあたりの取得件数の指定: サービス -> (パラメータ名, 最小値, 最大値)
+    # 指定しないと API 既定の小さなページ（50〜100 件）になり往復回数が増える。
+    # SNS ListTopics（100 件固定）と CloudFront ListDistributions は対象外
+    _PAGE_SIZE_PARAMS = {
+        'ec2': ('MaxResults', 5, 1000),
+        'ecs': ('maxResults', 1, 100),
+        'eks': ('maxResults', 1, 100),
+        'lambda': ('MaxItems', 1, 50),
+        'rds': ('MaxRecords', 20, 100),
+        'dynamodb': ('Limit', 1, 100),
+        'elasticache': ('MaxRecords', 20, 100),
+        'efs': ('MaxItems', 1, 100),
+        'elbv2': ('PageSize', 1, 400),
+        'sqs': ('MaxResults', 1, 1000),
+        'iam': ('MaxItems', 1, 1000),
+        'logs': ('limit', 1, 50),
+        'events': ('Limit', 1, 100),
+    }
+    
+    def __init__(self, region='ap-northeast-1', role_arn=None, external_id=None, session_name='AWSArchitectureDiagramGenerator',
+                 page_size=1000, page_sizes=None):
         """
         AWS リソースリーダーを初期化
         
@@ -21,10 +71,14 @@ class AWSResourceReader:
             role_arn: AssumeRole する IAM ロールの ARN（オプション）
             external_id: AssumeRole 時の外部 ID（オプション）
             session_name: AssumeRole 時のセッション名（デフォルト: AWSArchitectureDiagramGenerator）
+            page_size: 1 ページあたりの取得件数（各 API の上限で切り詰める、デフォルト: 1000）
+            page_sizes: サービスごとの page_size の上書き（例: {'ec2': 1000, 'iam': 500}）
         """
         self.region = region
         self.errors = []
         self.role_arn = role_arn
+        self.page_size = page_size
+        self.page_sizes = page_sizes or {}
         
         # リソースストレージ
         self.vpcs = {}
@@ -179,6 +233,15 @@ class AWSResourceReader:
             self.errors.append(f"⚠ {service_name}: {str(e)[:50]}")
             return None
     
+    def _page_kwargs(self, service):
+        """service の一覧 API に渡す 1 ページあたりの取得件数指定を返す"""
+        spec = self._PAGE_SIZE_PARAMS.get(service)
+        if spec is None:
+            return {}
+        param, minimum, maximum = spec
+        size = self.page_sizes.get(service, self.page_size)
+        return {param: max(minimum, min(size, maximum))}
+    
     def _get_name_tag(self, tags):
         """タグから Name を取得"""
         if not tags:
@@ -257,7 +320,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('ec2')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -338,7 +401,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('ec2')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -386,7 +449,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('ec2')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -430,7 +493,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('ec2')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -484,7 +547,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('ec2')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -541,7 +604,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('ecs')
             if next_token:
                 kwargs['nextToken'] = next_token
             
@@ -603,7 +666,7 @@ class AWSResourceReader:
             next_token = None
             
             while True:
-                kwargs = {'cluster': cluster_arn}
+                kwargs = {'cluster': cluster_arn, **self._page_kwargs('ecs')}
                 if next_token:
                     kwargs['nextToken'] = next_token
                 
@@ -669,7 +732,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('eks')
             if next_token:
                 kwargs['nextToken'] = next_token
             
@@ -723,7 +786,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('lambda')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -805,7 +868,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('rds')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -862,7 +925,7 @@ class AWSResourceReader:
         last_table = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('dynamodb')
             if last_table:
                 kwargs['ExclusiveStartTableName'] = last_table
             
@@ -909,7 +972,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('elasticache')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -988,7 +1051,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('efs')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -1031,7 +1094,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('elbv2')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -1156,7 +1219,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('elbv2')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -1170,6 +1233,11 @@ class AWSResourceReader:
             if not marker:
                 break
         
+        # LB の ARN -> 名前（ターゲットグループごとに全 LB を走査しないよう 1 回だけ作る）
+        lb_name_by_arn = {}
+        for lb_name, lb_data in self.load_balancers.items():
+            lb_name_by_arn.setdefault(lb_data.get('LoadBalancerArn'), lb_name)
+        
         for tg in all_tgs:
             tg_name = tg['TargetGroupName']
             tg_arn = tg['TargetGroupArn']
@@ -1222,10 +1290,9 @@ class AWSResourceReader:
             }
             
             for lb_arn in lb_arns:
-                for lb_name, lb_data in self.load_balancers.items():
-                    if lb_data.get('LoadBalancerArn') == lb_arn:
-                        self.relationships.append((lb_name, tg_name, 'routes_to', 'routes'))
-                        break
+                lb_name = lb_name_by_arn.get(lb_arn)
+                if lb_name is not None:
+                    self.relationships.append((lb_name, tg_name, 'routes_to', 'routes'))
         
         print(f"    Found {len(self.target_groups)} Target Group(s)")
     
@@ -1239,7 +1306,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('sqs')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -1341,7 +1408,7 @@ class AWSResourceReader:
         marker = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('iam')
             if marker:
                 kwargs['Marker'] = marker
             
@@ -1382,7 +1449,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('logs')
             if next_token:
                 kwargs['nextToken'] = next_token
             
@@ -1584,7 +1651,7 @@ class AWSResourceReader:
         next_token = None
         
         while True:
-            kwargs = {}
+            kwargs = self._page_kwargs('events')
             if next_token:
                 kwargs['NextToken'] = next_token
             
@@ -1702,9 +1769,7 @@ class AWSResourceReader:
     
     def read_all_resources(self):
         """すべてのリソースを読み取る"""
-        print("=" * 80)
-        print("Reading AWS Resources...")
-        print("=" * 80 + "\n")
+        self._print_read_header()
         
         # VPC 関連
         self.read_vpcs()
@@ -1746,6 +1811,49 @@ class AWSResourceReader:
         self.read_api_gateways()
         self.read_cloudwatch_event_rules()
         
+        return self._print_read_summary()
+    
+    def read_all_resources_parallel(self, max_workers=16, done_queue=None):
+        """
+        すべてのリソースをサービス単位で並列に読み取る
+        
+        boto3 クライアントはスレッドセーフなので、_init_clients で作成済みのものを共有する。
+        関係・エラーの並びとログ出力はサービスの完了順になる。
+        
+        Args:
+            max_workers: 同時に実行する読み取りの数
+            done_queue: 読み取りが完了したコレクション属性名を put するキュー（オプション）
+            
+        Returns:
+            int: 読み取ったリソースの総数
+        """
+        self._print_read_header()
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._run_reads, methods): collections
+                for methods, collections in self._PARALLEL_READS
+            }
+            for future in as_completed(futures):
+                future.result()
+                if done_queue is not None:
+                    for collection in futures[future]:
+                        done_queue.put(collection)
+        
+        return self._print_read_summary()
+    
+    def _run_reads(self, methods):
+        """read メソッドを順に呼ぶ（並列読み取りの 1 タスク）"""
+        for method in methods:
+            getattr(self, method)()
+    
+    def _print_read_header(self):
+        print("=" * 80)
+        print("Reading AWS Resources...")
+        print("=" * 80 + "\n")
+    
+    def _print_read_summary(self):
+        """統計とエラーを表示し、リソースの総数を返す"""
         # 統計
         total = (
             len(self.vpcs) + len(self.subnets) + len(self.internet_gateways) +
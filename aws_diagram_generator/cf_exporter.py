@@ -4,10 +4,18 @@ CloudFormation エクスポート/インポートモジュール
 """
 
 import os
+import re
 import yaml
 from collections import defaultdict
 
 
+# Lambda 関数 ARN から関数名を抽出（arn:aws:lambda:...:function:NAME[:ALIAS]）
+_FN_ARN = re.compile(r':function:([^:]+)')
+
+# YAML のドキュメント開始（行頭の ---）。ブロックスカラー内の行はインデントされるため誤検出しない
+_DOCUMENT_START = re.compile(r'^---(?=[ \t]|$)', re.M)
+
+
 # ==================== YAML カスタムローダー ====================
 
 class CloudFormationLoader(yaml.SafeLoader):
@@ -112,86 +120,140 @@ CloudFormationLoader.add_constructor('!Condition', condition_constructor)
 
 # ==================== エクスポート ====================
 
-def export_cloudformation(reader, output_dir):
-    """リソースを CloudFormation 形式で保存"""
+# libyaml が使える場合は C 実装の Dumper を使用
+_YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+# カテゴリ名 -> リーダーのコレクション属性名（エクスポート順）
+_EXPORT_CATEGORIES = [
+    ('vpc', 'vpcs'),
+    ('subnet', 'subnets'),
+    ('internet-gateway', 'internet_gateways'),
+    ('nat-gateway', 'nat_gateways'),
+    ('security-group', 'security_groups'),
+    ('vpc-endpoint', 'vpc_endpoints'),
+    ('route-table', 'route_tables'),
+    ('ec2', 'ec2_instances'),
+    ('ecs-cluster', 'ecs_clusters'),
+    ('ecs-service', 'ecs_services'),
+    ('eks', 'eks_clusters'),
+    ('lambda', 'lambda_functions'),
+    ('rds', 'rds_instances'),
+    ('dynamodb', 'dynamodb_tables'),
+    ('elasticache', 'elasticache_clusters'),
+    ('s3', 's3_buckets'),
+    ('efs', 'efs_filesystems'),
+    ('load-balancer', 'load_balancers'),
+    ('alb-listener', 'alb_listeners'),
+    ('target-group', 'target_groups'),
+    ('sqs', 'sqs_queues'),
+    ('sns', 'sns_topics'),
+    ('iam-role', 'iam_roles'),
+    ('cloudwatch-log-group', 'log_groups'),
+    ('cloudfront', 'cloudfront_distributions'),
+    ('api-gateway', 'api_gateways'),
+    ('cloudwatch-event-rule', 'cloudwatch_event_rules'),
+]
+
+# コレクション属性名 -> カテゴリ名（ストリーミングエクスポート用）
+_CATEGORY_BY_COLLECTION = {attr: category for category, attr in _EXPORT_CATEGORIES}
+
+
+def _print_export_header(output_dir):
     print("\n" + "=" * 80)
     print(f"Exporting CloudFormation to: {output_dir}")
     print("=" * 80 + "\n")
+
+
+def _write_category(output_dir, category, resources):
+    """1 カテゴリ分のリソースを書き出し、書き出した件数を返す（空なら何もしない）"""
+    if not resources:
+        return 0
+    
+    # カテゴリごとに 1 ファイル（YAML マルチドキュメント）にまとめる
+    filename = os.path.join(output_dir, f"{category}.yaml")
+    
+    with open(filename, 'w', encoding='utf-8') as f:
+        yaml.dump_all(
+            (_to_cf_document(resource_id, resource_data) for resource_id, resource_data in resources.items()),
+            f,
+            Dumper=_YAML_DUMPER,
+            explicit_start=True,
+            default_flow_style=False,
+            allow_unicode=True,
+            sort_keys=False
+        )
+    
+    print(f"  {category}: {len(resources)} resource(s)")
+    return len(resources)
+
+
+def export_cloudformation(reader, output_dir):
+    """リソースを CloudFormation 形式で保存"""
+    _print_export_header(output_dir)
     
     os.makedirs(output_dir, exist_ok=True)
     
-    resource_collections = [
-        ('vpc', reader.vpcs),
-        ('subnet', reader.subnets),
-        ('internet-gateway', reader.internet_gateways),
-        ('nat-gateway', reader.nat_gateways),
-        ('security-group', reader.security_groups),
-        ('vpc-endpoint', reader.vpc_endpoints),
-        ('route-table', reader.route_tables),
-        ('ec2', reader.ec2_instances),
-        ('ecs-cluster', reader.ecs_clusters),
-        ('ecs-service', reader.ecs_services),
-        ('eks', reader.eks_clusters),
-        ('lambda', reader.lambda_functions),
-        ('rds', reader.rds_instances),
-        ('dynamodb', reader.dynamodb_tables),
-        ('elasticache', reader.elasticache_clusters),
-        ('s3', reader.s3_buckets),
-        ('efs', reader.efs_filesystems),
-        ('load-balancer', reader.load_balancers),
-        ('alb-listener', reader.alb_listeners),
-        ('target-group', reader.target_groups),
-        ('sqs', reader.sqs_queues),
-        ('sns', reader.sns_topics),
-        ('iam-role', reader.iam_roles),
-        ('cloudwatch-log-group', reader.log_groups),
-        ('cloudfront', reader.cloudfront_distributions),
-        ('api-gateway', reader.api_gateways),
-        ('cloudwatch-event-rule', reader.cloudwatch_event_rules),
-    ]
+    total_resources = 0
+    total_files = 0
+    
+    for category, attr in _EXPORT_CATEGORIES:
+        count = _write_category(output_dir, category, getattr(reader, attr))
+        if count:
+            total_resources += count
+            total_files += 1
+    
+    print(f"\n✓ Exported {total_resources} resource(s) to {total_files} CloudFormation file(s)")
+    return total_resources
+
+
+def export_cloudformation_stream(reader, output_dir, done_queue):
+    """
+    読み取りが完了したコレクションから順に CloudFormation 形式で保存
+    
+    Args:
+        reader: AWSResourceReader
+        output_dir: 出力ディレクトリ
+        done_queue: 読み取り完了したコレクション属性名が流れてくるキュー（None で終了）
+    """
+    _print_export_header(output_dir)
+    
+    os.makedirs(output_dir, exist_ok=True)
     
+    total_resources = 0
     total_files = 0
     
-    for category, resources in resource_collections:
-        if not resources:
-            continue
-        
-        category_dir = os.path.join(output_dir, category)
-        os.makedirs(category_dir, exist_ok=True)
-        
-        for resource_id, resource_data in resources.items():
-            # ファイル名をサニタイズ
-            safe_name = resource_id.replace('/', '_').replace(':', '_').replace('*', '_')
-            safe_name = safe_name[:100]
-            
-            filename = os.path.join(category_dir, f"{safe_name}.yaml")
-            
-            # CloudFormation 形式で整形
-            cf_resource = {
-                'AWSTemplateFormatVersion': '2010-09-09',
-                'Description': f'Exported {resource_data.get("Type", "Resource")}: {resource_id}',
-                'Resources': {
-                    resource_id.replace('-', '').replace('_', ''): {
-                        'Type': resource_data.get('Type', 'AWS::CloudFormation::CustomResource'),
-                        'Properties': resource_data.get('Properties', {})
-                    }
-                },
-                'Metadata': {
-                    # 追加のメタデータを保存
-                    'ResourceId': resource_id,
-                    'ExtraInfo': {k: v for k, v in resource_data.items() if k not in ['Type', 'Properties']}
-                }
-            }
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                yaml.dump(cf_resource, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
-            
+    while True:
+        attr = done_queue.get()
+        if attr is None:
+            break
+        
+        count = _write_category(output_dir, _CATEGORY_BY_COLLECTION[attr], getattr(reader, attr))
+        if count:
+            total_resources += count
             total_files += 1
-        
-        print(f"  {category}: {len(resources)} file(s)")
     
-    print(f"\n✓ Exported {total_files} CloudFormation file(s)")
-    return total_files
+    print(f"\n✓ Exported {total_resources} resource(s) to {total_files} CloudFormation file(s)")
+    return total_resources
+
+
+def _to_cf_document(resource_id, resource_data):
+    """1 リソース分の CloudFormation ドキュメントを作成"""
+    return {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Description': f'Exported {resource_data.get("Type", "Resource")}: {resource_id}',
+        'Resources': {
+            resource_id.replace('-', '').replace('_', ''): {
+                'Type': resource_data.get('Type', 'AWS::CloudFormation::CustomResource'),
+                'Properties': resource_data.get('Properties', {})
+            }
+        },
+        'Metadata': {
+            # 追加のメタデータを保存
+            'ResourceId': resource_id,
+            'ExtraInfo': {k: v for k, v in resource_data.items() if k not in ['Type', 'Properties']}
+        }
+    }
 
 
 # ==================== インポート ====================
@@ -241,13 +303,33 @@ class CloudFormationImporter:
         self.errors = []
     
     def _parse_yaml(self, filepath):
-        """YAML ファイルを解析"""
+        """
+        YAML ファイルを解析（マルチドキュメント対応、ドキュメントのリストを返す）
+        
+        カテゴリごとに 1 ファイルのため、ドキュメントを 1 つずつ解析し、
+        壊れたドキュメントはエラーに記録して飛ばす（同じファイルの他のリソースは読み込む）
+        """
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                return yaml.load(f, Loader=CloudFormationLoader)
+                text = f.read()
         except Exception as e:
-            self.errors.append(f"⚠ Failed to parse {filepath}: {str(e)[:50]}")
-            return None
+            self.errors.append(f"⚠ Failed to read {filepath}: {str(e)[:50]}")
+            return []
+        
+        docs = []
+        doc_number = 0
+        for chunk in _DOCUMENT_START.split(text):
+            if not chunk.strip():
+                continue
+            doc_number += 1
+            try:
+                doc = yaml.load(chunk, Loader=CloudFormationLoader)
+            except Exception as e:
+                self.errors.append(f"⚠ Failed to parse {filepath} (document {doc_number}): {str(e)[:50]}")
+                continue
+            if doc:
+                docs.append(doc)
+        return docs
     
     def _get_resource_type_mapping(self):
         """リソースタイプとストレージのマッピング"""
@@ -303,34 +385,8 @@ class CloudFormationImporter:
         type_mapping = self._get_resource_type_mapping()
         
         for filepath in yaml_files:
-            data = self._parse_yaml(filepath)
-            if not data:
-                continue
-            
-            # Resources セクションを処理
-            resources = data.get('Resources', {})
-            metadata = data.get('Metadata', {})
-            extra_info = metadata.get('ExtraInfo', {})
-            resource_id = metadata.get('ResourceId')
-            
-            for res_name, res_data in resources.items():
-                res_type = res_data.get('Type', '')
-                properties = res_data.get('Properties', {})
-                
-                # リソース ID を決定
-                actual_id = resource_id or res_name
-                
-                # リソースデータを構築
-                resource_entry = {
-                    'Type': res_type,
-                    'Properties': properties,
-                    **extra_info
-                }
-                
-                # 適切なストレージに保存
-                storage = type_mapping.get(res_type)
-                if storage is not None:
-                    storage[actual_id] = resource_entry
+            for data in self._parse_yaml(filepath):
+                self._import_document(data, type_mapping)
         
         # 関係を再構築
         self._rebuild_relationships()
@@ -378,6 +434,33 @@ class CloudFormationImporter:
         
         return total
     
+    def _import_document(self, data, type_mapping):
+        """CloudFormation ドキュメント 1 件を読み込む"""
+        # Resources セクションを処理
+        resources = data.get('Resources', {})
+        metadata = data.get('Metadata', {})
+        extra_info = metadata.get('ExtraInfo', {})
+        resource_id = metadata.get('ResourceId')
+        
+        for res_name, res_data in resources.items():
+            res_type = res_data.get('Type', '')
+            properties = res_data.get('Properties', {})
+            
+            # リソース ID を決定
+            actual_id = resource_id or res_name
+            
+            # リソースデータを構築
+            resource_entry = {
+                'Type': res_type,
+                'Properties': properties,
+                **extra_info
+            }
+            
+            # 適切なストレージに保存
+            storage = type_mapping.get(res_type)
+            if storage is not None:
+                storage[actual_id] = resource_entry
+    
     def _rebuild_relationships(self):
         """リソース間の関係を再構築"""
         
@@ -437,10 +520,10 @@ class CloudFormationImporter:
             for trigger in func_data.get('Triggers', []):
                 arn = trigger.get('EventSourceArn', '')
                 if ':sns:' in arn:
-                    topic_name = arn.split(':')[-1]
+                    topic_name = arn.rpartition(':')[2]
                     self.relationships.append((topic_name, func_name, 'triggers', 'triggers'))
                 elif ':sqs:' in arn:
-                    queue_name = arn.split(':')[-1]
+                    queue_name = arn.rpartition(':')[2]
                     self.relationships.append((queue_name, func_name, 'triggers', 'triggers'))
         
         # RDS -> Subnet
@@ -455,14 +538,16 @@ class CloudFormationImporter:
             for subnet_id in subnet_ids:
                 self.relationships.append((lb_name, subnet_id, 'in_subnet', 'deployed'))
         
-        # Load Balancer -> Target Group
+        # Load Balancer -> Target Group（LB は ARN -> 名前の辞書で引く）
+        lb_name_by_arn = {}
+        for lb_name, lb_data in self.load_balancers.items():
+            lb_name_by_arn.setdefault(lb_data.get('LoadBalancerArn'), lb_name)
         for tg_name, tg_data in self.target_groups.items():
             lb_arns = tg_data.get('LoadBalancerArns', [])
             for lb_arn in lb_arns:
-                for lb_name, lb_data in self.load_balancers.items():
-                    if lb_data.get('LoadBalancerArn') == lb_arn:
-                        self.relationships.append((lb_name, tg_name, 'routes_to', 'routes'))
-                        break
+                lb_name = lb_name_by_arn.get(lb_arn)
+                if lb_name is not None:
+                    self.relationships.append((lb_name, tg_name, 'routes_to', 'routes'))
             
             # Target Group -> ターゲット（EC2/Lambda）
             targets = tg_data.get('Targets', [])
@@ -471,9 +556,10 @@ class CloudFormationImporter:
                 target_id = target.get('Id', '')
                 if target_type == 'instance' and target_id.startswith('i-'):
                     self.relationships.append((tg_name, target_id, 'targets', 'routes to'))
-                elif target_type == 'lambda' and ':function:' in target_id:
-                    func_name = target_id.split(':function:')[-1].split(':')[0]
-                    self.relationships.append((tg_name, func_name, 'targets', 'routes to'))
+                elif target_type == 'lambda':
+                    m = _FN_ARN.search(target_id)
+                    if m:
+                        self.relationships.append((tg_name, m.group(1), 'targets', 'routes to'))
         
         # SNS -> Lambda（サブスクリプションから）
         for topic_name, topic_data in self.sns_topics.items():
@@ -485,7 +571,6 @@ class CloudFormationImporter:
             subscriptions = topic_data.get('Subscriptions', [])
             for sub in subscriptions:
                 if sub.get('Protocol') == 'lambda':
-                    endpoint = sub.get('Endpoint', '')
-                    if ':function:' in endpoint:
-                        func_name = endpoint.split(':function:')[-1].split(':')[0]
-                        self.relationships.append((topic_name, func_name, 'triggers', 'SNS trigger'))
+                    m = _FN_ARN.search(sub.get('Endpoint', ''))
+                    if m:
+                        self.relationships.append((topic_name, m.group(1), 'triggers', 'SNS trigger'))
@@ -4,9 +4,15 @@
 リソースから図を生成する
 """
 
+import hashlib
 import os
+import shutil
+import subprocess
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
 
+import diagrams
 from diagrams import Diagram, Cluster, Edge
 from diagrams.aws.network import (
     VPC, InternetGateway, PrivateSubnet, PublicSubnet, NATGateway,
@@ -16,30 +22,372 @@ from diagrams.aws.compute import EC2, ECS, EKS, Lambda, Fargate
 from diagrams.aws.database import RDS, Dynamodb, ElastiCache
 from diagrams.aws.storage import S3, EFS
 from diagrams.aws.integration import SQS, SNS
-from diagrams.generic.blank import Blank
+
+
+# 読み取り専用の空 dict（.get の既定値として毎回 {} を生成しないため）
+_EMPTY = {}
+
+# vpc_resources にない VPC の読み取り用既定値
+_EMPTY_VPC = {'target_groups': (), 'load_balancers': ()}
+
+
+# 関係の種類ごとの線のスタイル: rel_type -> (color, style, label)
+_EDGE_STYLES = {
+    'attached_to': ('blue', 'bold', ''),
+    'belongs_to': ('gray', 'dashed', ''),
+    'in_subnet': ('green', 'solid', ''),
+    'in_vpc': ('blue', 'dotted', ''),
+    'in_cluster': ('purple', 'solid', ''),
+    'routes_to': ('red', 'solid', ''),
+    'targets': ('red', 'dashed', 'targets'),
+    'triggers': ('orange', 'bold', 'trigger'),
+}
+_DEFAULT_EDGE_STYLE = ('gray', 'solid', '')
+
+
+# 集約ノード間の接続ルール: (source, target, edge_kind, color, style, label)
+# source が None の場合はノード化済みの最初の Lambda を使用
+_COMBINED_EDGE_RULES = (
+    (None, 'dynamodb_combined', 'lambda_ddb', 'orange', 'dotted', ''),
+    (None, 's3_combined', 'lambda_s3', 'purple', 'dotted', ''),
+    ('sns_combined', 'lambda_external', 'sns_trigger', 'orange', 'bold', 'trigger'),
+    ('sqs_combined', 'lambda_external', 'sqs_trigger', 'orange', 'bold', 'trigger'),
+)
+
+
+# 図の内容に影響する reader の属性（generate の再生成判定に使用）
+_DIGEST_ATTRS = (
+    'vpcs', 'subnets', 'internet_gateways', 'nat_gateways', 'vpc_endpoints',
+    'ec2_instances', 'ecs_services', 'eks_clusters', 'lambda_functions', 'rds_instances',
+    'load_balancers', 'target_groups', 's3_buckets', 'dynamodb_tables',
+    'sqs_queues', 'sns_topics', 'efs_filesystems', 'relationships',
+)
+
+
+class _DotSourceDiagram(Diagram):
+    """Graphviz を起動せず DOT ソース（<filename>.dot）のみを書き出す Diagram"""
+    
+    def render(self):
+        with open(f"{self.filename}.dot", 'w', encoding='utf-8') as f:
+            f.write(self.dot.source)
+        # Diagram.__exit__ が削除する一時ソースファイル
+        self.dot.save()
+
+
+# ==================== DOT 直接出力（diagrams を介さない軽量レンダラー） ====================
+
+# diagrams パッケージのアイコン（resources/...）の基準ディレクトリ
+_DIAGRAMS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(diagrams.__file__)))
+
+
+def _dot_quote(value):
+    """DOT の文字列リテラルに変換"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def _dot_attrs(attrs):
+    """属性 dict を DOT の属性リスト（a="x", b="y"）に変換"""
+    return ', '.join(f'{key}={_dot_quote(value)}' for key, value in attrs.items())
+
+
+class _LeanDiagram:
+    """
+    diagrams.Diagram と同じ使い方で DOT テキストを直接組み立てる Diagram
+    
+    graphviz.Digraph やアイコン画像の読み込みを経由せず、行のリストに書き出して
+    最後に dot を 1 回だけ起動する
+    """
+    
+    # diagrams.Diagram と同じ既定属性
+    GRAPH_ATTR = {
+        "pad": "2.0", "splines": "ortho", "nodesep": "0.60", "ranksep": "0.75",
+        "fontname": "Sans-Serif", "fontsize": "15", "fontcolor": "#2D3436",
+    }
+    NODE_ATTR = {
+        "shape": "box", "style": "rounded", "fixedsize": "true", "width": "1.4", "height": "1.4",
+        "labelloc": "b", "imagescale": "true",
+        "fontname": "Sans-Serif", "fontsize": "13", "fontcolor": "#2D3436",
+    }
+    EDGE_ATTR = {"color": "#7B8894"}
+    
+    # 描画中の Diagram（Cluster / ノード / エッジの書き込み先）
+    current = None
+    
+    def __init__(self, name="", filename="", show=False, direction="LR", outformat="png", graph_attr=None):
+        self.filename = filename
+        self.outformat = outformat
+        self.graph_attr = {**self.GRAPH_ATTR, "label": name, "rankdir": direction, **(graph_attr or {})}
+        self.lines = []
+        self.depth = 1
+        self.counter = 0
+    
+    def __enter__(self):
+        _LeanDiagram.current = self
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        _LeanDiagram.current = None
+        if exc_type is not None:
+            return False
+        
+        dot_file = f"{self.filename}.dot"
+        with open(dot_file, 'w', encoding='utf-8') as f:
+            self._emit_dot(f)
+        self.render(dot_file)
+        return False
+    
+    def _emit_dot(self, stream):
+        """DOT ソース全体を stream に書き出す"""
+        stream.write(f"digraph {{\n  graph [{_dot_attrs(self.graph_attr)}]\n")
+        stream.write(f"  node [{_dot_attrs(self.NODE_ATTR)}]\n  edge [{_dot_attrs(self.EDGE_ATTR)}]\n")
+        stream.write('\n'.join(self.lines))
+        stream.write("\n}\n")
+    
+    def render(self, dot_file):
+        """dot で各出力形式にレンダリング（'dot' 以外の場合はソースを削除）"""
+        formats = self.outformat if isinstance(self.outformat, list) else [self.outformat]
+        dot_path = ArchitectureDiagramGenerator._dot_path()
+        for fmt in formats:
+            if fmt != 'dot':
+                subprocess.run([dot_path, f'-T{fmt}', '-o', f"{self.filename}.{fmt}", dot_file], check=True)
+        if 'dot' not in formats:
+            os.remove(dot_file)
+    
+    def add(self, line):
+        """現在のクラスター階層に 1 行追加"""
+        self.lines.append('  ' * self.depth + line)
+    
+    def next_id(self):
+        """ノード / クラスターの連番 ID"""
+        self.counter += 1
+        return f"n{self.counter}"
+
+
+class _LeanDotSourceDiagram(_LeanDiagram):
+    """dot を起動せず DOT ソース（<filename>.dot）のみを書き出す _LeanDiagram"""
+    
+    def render(self, dot_file):
+        pass
+
+
+class _LeanCluster:
+    """diagrams.Cluster 互換（subgraph cluster_* を書き出す）"""
+    
+    # diagrams.Cluster と同じ既定属性
+    GRAPH_ATTR = {
+        "shape": "box", "style": "rounded", "labeljust": "l", "pencolor": "#AEB6BE",
+        "fontname": "Sans-Serif", "fontsize": "12",
+    }
+    
+    def __init__(self, label="cluster", direction="LR", graph_attr=None):
+        self.graph_attr = {**self.GRAPH_ATTR, "label": label, **(graph_attr or {})}
+    
+    def __enter__(self):
+        diagram = _LeanDiagram.current
+        diagram.add(f"subgraph cluster_{diagram.next_id()} {{")
+        diagram.depth += 1
+        diagram.add(f"graph [{_dot_attrs(self.graph_attr)}]")
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        diagram = _LeanDiagram.current
+        diagram.depth -= 1
+        diagram.add("}")
+        return False
+
+
+class _LeanNode:
+    """diagrams のノード互換（アイコンはファイルパスで参照するだけで読み込まない）"""
+    
+    _icon_path = None
+    
+    def __init__(self, label=""):
+        diagram = _LeanDiagram.current
+        self.node_id = diagram.next_id()
+        attrs = {"label": label}
+        if self._icon_path:
+            # diagrams と同じく、ラベルの行数に応じてノードを縦に伸ばす
+            attrs.update(shape="none", height=str(1.9 + 0.4 * label.count('\n')), image=self._icon_path)
+        diagram.add(f"{self.node_id} [{_dot_attrs(attrs)}]")
+    
+    def __rshift__(self, edge):
+        edge.source = self
+        return edge
+
+
+class _LeanEdge:
+    """diagrams.Edge 互換（node >> edge >> node で 1 本書き出す）"""
+    
+    def __init__(self, color="", style="", label=""):
+        attrs = {"color": color, "style": style, "label": label}
+        self.attrs = _dot_attrs({key: value for key, value in attrs.items() if value})
+        self.source = None
+    
+    def __rshift__(self, target):
+        line = f"{self.source.node_id} -> {target.node_id}"
+        _LeanDiagram.current.add(f"{line} [{self.attrs}]" if self.attrs else line)
+        return target
+
+
+def _lean_node_class(node_cls):
+    """diagrams のノードクラスから、同じアイコンを参照する _LeanNode のサブクラスを作成"""
+    icon_path = os.path.join(_DIAGRAMS_ROOT, node_cls._icon_dir, node_cls._icon)
+    return type(node_cls.__name__, (_LeanNode,), {'_icon_path': icon_path})
+
+
+# 図で使用するノードクラス
+_NODE_CLASSES = (
+    InternetGateway, NATGateway, ELB, ALB, NLB, Endpoint,
+    EC2, Fargate, EKS, Lambda, RDS, Dynamodb, S3, EFS, SQS, SNS,
+)
+
+# レンダラーごとの Diagram / Cluster / Edge / ノードクラス
+# 'diagrams': diagrams ライブラリ経由、'dot': DOT テキストを直接書き出す軽量版
+_RENDERERS = {
+    'diagrams': SimpleNamespace(
+        Diagram=Diagram, SourceDiagram=_DotSourceDiagram, Cluster=Cluster, Edge=Edge,
+        **{node_cls.__name__: node_cls for node_cls in _NODE_CLASSES}
+    ),
+    'dot': SimpleNamespace(
+        Diagram=_LeanDiagram, SourceDiagram=_LeanDotSourceDiagram, Cluster=_LeanCluster, Edge=_LeanEdge,
+        **{node_cls.__name__: _lean_node_class(node_cls) for node_cls in _NODE_CLASSES}
+    ),
+}
+
+
+def _edge(edges, kit, color, style, label=''):
+    """
+    スタイルごとに 1 つだけ Edge を作成して使い回す
+    
+    edges は 1 回の _draw_relationships の間だけ使うキャッシュ。
+    Edge は >> の度に接続元が上書きされるため、描画をまたいで共有しない
+    """
+    key = (color, style, label)
+    edge = edges.get(key)
+    if edge is None:
+        edge = edges[key] = kit.Edge(color=color, style=style, label=label)
+    return edge
+
+
+def _display_label(kind, res_id, res_data):
+    """サブネット内リソースの表示ラベル（整理時に 1 回だけ計算）"""
+    if kind == 'ec2':
+        return res_data.get('Name', res_id)[:15]
+    if kind == 'nat_gateways':
+        return f"NAT\n{res_data.get('Name', res_id)[:10]}"
+    if kind == 'vpc_endpoints':
+        service_name = res_data.get('ServiceName', '')
+        # サービス名を短縮
+        short_service = service_name.split('.')[-1] if '.' in service_name else service_name
+        return f"Endpoint\n{short_service[:12]}"
+    return res_id[:15]
+
+
+def _field(data, key):
+    """トップレベル、なければ Properties からフィールドを取得"""
+    return data.get(key) or (data.get('Properties') or _EMPTY).get(key)
 
 
 class ArchitectureDiagramGenerator:
     """アーキテクチャ図を生成するクラス"""
     
-    def __init__(self, reader):
+    # サブネットへの振り分け: (reader の属性, subnet_resources のキー, フィールド, リストか)
+    _SUBNET_DISPATCH = (
+        ('ec2_instances', 'ec2', 'SubnetId', False),
+        ('ecs_services', 'ecs_services', 'SubnetIds', True),
+        ('eks_clusters', 'eks_clusters', 'SubnetIds', True),
+        ('rds_instances', 'rds', 'SubnetIds', True),
+        ('nat_gateways', 'nat_gateways', 'SubnetId', False),
+    )
+    
+    # VPC 外リソース: (reader の属性, external_resources のキー)
+    _EXTERNAL_DISPATCH = (
+        ('s3_buckets', 's3'),
+        ('dynamodb_tables', 'dynamodb'),
+        ('sqs_queues', 'sqs'),
+        ('sns_topics', 'sns'),
+        ('efs_filesystems', 'efs'),
+    )
+    
+    # Graphviz のデフォルトグラフ属性
+    GRAPH_ATTR = {
+        "fontsize": "14",
+        "bgcolor": "white",
+        "splines": "ortho",
+        "nodesep": "0.6",
+        "ranksep": "0.8",
+        "pad": "0.5",
+        "fontname": "Sans-Serif"
+    }
+    
+    # リソース数がこれを超えると高速レイアウト（splines=polyline）に切り替える
+    FAST_LAYOUT_THRESHOLD = 200
+    
+    # サブネット内の同種リソースがこれを超えると 1 ノードに集約する
+    COMBINE_THRESHOLD = 2
+    
+    # 集約ルール: (subnet_resources の種別, 集約ノードキーの接頭辞, 集約ラベル, しきい値)
+    # しきい値が None の場合は COMBINE_THRESHOLD を使用
+    _COMBINE_RULES = (
+        ('load_balancers', 'lb', "Load Balancers\n({count})", 1),
+        ('ec2', 'ec2', "EC2\n({count} instances)", None),
+        ('ecs_services', 'ecs', "ECS Services\n({count})", None),
+        ('eks_clusters', 'eks', "EKS Clusters\n({count})", None),
+        ('lambda', 'lambda', "Lambda\n({count} VPC)", None),
+        ('rds', 'rds', "RDS\n({count} instances)", None),
+    )
+    
+    # サブネット内ノードのアイコン（描画順）: (subnet_resources の種別, ノードクラス名)
+    _SUBNET_NODE_ICONS = (
+        ('ec2', 'EC2'),
+        ('ecs_services', 'Fargate'),
+        ('eks_clusters', 'EKS'),
+        ('lambda', 'Lambda'),
+        ('rds', 'RDS'),
+    )
+    
+    # 解決済みの dot バイナリパス（クラス全体でキャッシュ）
+    _dot_binary = None
+    
+    __slots__ = (
+        'reader', 'graph_attr', 'fast', 'layout', 'renderer',
+        'subnet_resources', 'external_resources', 'vpc_resources',
+        'subnets_by_vpc', 'igws_by_vpc', 'subnet_labels', 'rel_by_source',
+        'subnet_has_resources', 'subnet_resource_count',
+    )
+    
+    def __init__(self, reader, graph_attr=None, fast=None, layout=None, renderer='diagrams'):
         """
         Args:
             reader: AWSResourceReader または CloudFormationImporter のインスタンス
+            graph_attr: GRAPH_ATTR を上書きする Graphviz グラフ属性（オプション）
+            fast: True で高速レイアウトを強制、False で無効、None でリソース数から自動判定
+            layout: Graphviz のレイアウトエンジン（例: "sfdp"、オプション）
+            renderer: 'diagrams'（diagrams ライブラリ経由）または
+                'dot'（DOT テキストを直接書き出して dot を起動する軽量版）
         """
+        if renderer not in _RENDERERS:
+            raise ValueError(f"Unknown renderer: {renderer}")
+        
         self.reader = reader
+        self.graph_attr = graph_attr or {}
+        self.fast = fast
+        self.layout = layout
+        self.renderer = renderer
         
-        # サブネットごとのリソースを整理
-        self.subnet_resources = defaultdict(lambda: {
-            'ec2': [],
-            'ecs_services': [],
-            'eks_clusters': [],
-            'lambda': [],
-            'rds': [],
-            'nat_gateways': [],
-            'load_balancers': [],
-            'vpc_endpoints': [],
-        })
+        self._reset_resources()
+    
+    def _reset_resources(self):
+        """
+        整理結果を空に戻す
+        
+        _organize_resources は集約ノードへの置き換えなどを行うため、整理のたびに作り直す
+        （同じインスタンスで generate を繰り返したときに前回の結果へ追記しない）
+        """
+        # サブネットごとのリソースを整理（キー: (subnet_id, 種別)）
+        # 整理後、しきい値を超えたバケットは集約ノード 1 件に置き換わる
+        self.subnet_resources = defaultdict(list)
+        self.subnet_resource_count = 0
         
         # VPC 外のリソース
         self.external_resources = {
@@ -54,38 +402,62 @@ class ArchitectureDiagramGenerator:
         }
         
         # VPC 内の集約リソース（サブネット指定なし）
-        self.vpc_resources = defaultdict(lambda: {
-            'target_groups': [],
-            'load_balancers': [],
-        })
+        # 読み取り側で空エントリを作らないよう、書き込み時のみ setdefault で作成する
+        self.vpc_resources = {}
+        
+        # VPC ID -> {subnet_id: subnet_data} / [(igw_id, igw_label)] のインデックス
+        self.subnets_by_vpc = defaultdict(dict)
+        self.igws_by_vpc = defaultdict(list)
+        
+        # subnet_id -> クラスターラベル
+        self.subnet_labels = {}
+        
+        # source_id -> [(target_id, rel_type, label)]
+        self.rel_by_source = defaultdict(list)
+        
+        # 描画対象のリソースを 1 つ以上持つサブネット ID
+        self.subnet_has_resources = set()
     
     def _organize_resources(self):
         """リソースをサブネットごとに整理"""
+        self._reset_resources()
         reader = self.reader
         
-        # EC2 -> Subnet
-        for ec2_id, ec2_data in reader.ec2_instances.items():
-            subnet_id = ec2_data.get('SubnetId') or ec2_data.get('Properties', {}).get('SubnetId')
-            if subnet_id and subnet_id in reader.subnets:
-                self.subnet_resources[subnet_id]['ec2'].append((ec2_id, ec2_data))
+        # ループ内の属性参照を避けるためローカル変数に束縛
+        subnets = reader.subnets
+        vpcs = reader.vpcs
+        subnet_resources = self.subnet_resources
+        external_resources = self.external_resources
         
-        # ECS Service -> Subnet
-        for svc_name, svc_data in reader.ecs_services.items():
-            subnet_ids = svc_data.get('SubnetIds', [])
-            if subnet_ids:
-                # 最初のサブネットに配置
-                subnet_id = subnet_ids[0]
-                if subnet_id in reader.subnets:
-                    self.subnet_resources[subnet_id]['ecs_services'].append((svc_name, svc_data))
+        # VPC ごとのサブネット / IGW インデックス（VPC ループでの全件走査を避ける）
+        subnets_by_vpc = self.subnets_by_vpc
+        subnet_labels = self.subnet_labels
+        for subnet_id, subnet_data in subnets.items():
+            vpc_id = _field(subnet_data, 'VpcId')
+            subnets_by_vpc[vpc_id][subnet_id] = subnet_data
+            
+            # サブネットのクラスターラベル
+            subnet_name = subnet_data.get('Name', subnet_id)
+            cidr = subnet_data.get('CidrBlock', '')
+            az = subnet_data.get('AvailabilityZone', '')
+            az_short = az[-2:] if az else ''
+            subnet_labels[subnet_id] = f"{subnet_name[:20]}\n{cidr}\n({az_short})"
         
-        # EKS Cluster -> Subnet
-        for cluster_name, cluster_data in reader.eks_clusters.items():
-            subnet_ids = cluster_data.get('SubnetIds', [])
-            if subnet_ids:
-                # 最初のサブネットに配置
-                subnet_id = subnet_ids[0]
-                if subnet_id in reader.subnets:
-                    self.subnet_resources[subnet_id]['eks_clusters'].append((cluster_name, cluster_data))
+        igws_by_vpc = self.igws_by_vpc
+        for igw_id, igw_data in reader.internet_gateways.items():
+            vpc_id = igw_data.get('AttachedVpcId')
+            if vpc_id:
+                igw_name = igw_data.get('Name', igw_id)
+                igws_by_vpc[vpc_id].append((igw_id, f"IGW\n{igw_name[:15]}"))
+        
+        # 関係を source ごとにインデックス化（_draw_relationships で使用）
+        rel_by_source = self.rel_by_source
+        for source_id, target_id, rel_type, label in reader.relationships:
+            rel_by_source[source_id].append((target_id, rel_type, label))
+        
+        # EC2 / ECS / EKS / RDS / NAT Gateway -> Subnet
+        for reader_attr, bucket, field, is_list in self._SUBNET_DISPATCH:
+            self._assign_to_subnet(getattr(reader, reader_attr), bucket, field, is_list)
         
         # Lambda -> Subnet (VPC Lambda)
         for func_name, func_data in reader.lambda_functions.items():
@@ -93,81 +465,122 @@ class ArchitectureDiagramGenerator:
             if subnet_ids:
                 # 最初のサブネットに配置
                 subnet_id = subnet_ids[0]
-                if subnet_id in reader.subnets:
-                    self.subnet_resources[subnet_id]['lambda'].append((func_name, func_data))
+                if subnet_id in subnets:
+                    subnet_resources[(subnet_id, 'lambda')].append((func_name, func_data, _display_label('lambda', func_name, func_data)))
             else:
                 # VPC 外の Lambda
-                self.external_resources['lambda'].append((func_name, func_data))
-        
-        # RDS -> Subnet
-        for db_id, db_data in reader.rds_instances.items():
-            subnet_ids = db_data.get('SubnetIds', [])
-            if subnet_ids:
-                subnet_id = subnet_ids[0]
-                if subnet_id in reader.subnets:
-                    self.subnet_resources[subnet_id]['rds'].append((db_id, db_data))
-        
-        # NAT Gateway -> Subnet
-        for nat_id, nat_data in reader.nat_gateways.items():
-            subnet_id = nat_data.get('SubnetId') or nat_data.get('Properties', {}).get('SubnetId')
-            if subnet_id and subnet_id in reader.subnets:
-                self.subnet_resources[subnet_id]['nat_gateways'].append((nat_id, nat_data))
+                external_resources['lambda'].append((func_name, func_data))
         
         # VPC Endpoint -> Subnet (同じサブネットに複数ある場合は1つだけ)
         subnet_has_endpoint = set()
         for ep_id, ep_data in reader.vpc_endpoints.items():
-            subnet_ids = ep_data.get('SubnetIds', []) or ep_data.get('Properties', {}).get('SubnetIds', [])
+            subnet_ids = _field(ep_data, 'SubnetIds') or []
             for subnet_id in subnet_ids:
-                if subnet_id in reader.subnets and subnet_id not in subnet_has_endpoint:
-                    self.subnet_resources[subnet_id]['vpc_endpoints'].append((ep_id, ep_data))
+                if subnet_id in subnets and subnet_id not in subnet_has_endpoint:
+                    subnet_resources[(subnet_id, 'vpc_endpoints')].append((ep_id, ep_data, _display_label('vpc_endpoints', ep_id, ep_data)))
                     subnet_has_endpoint.add(subnet_id)
                     break
         
         # Load Balancer -> Subnet or VPC
         for lb_name, lb_data in reader.load_balancers.items():
-            subnet_ids = lb_data.get('SubnetIds', []) or lb_data.get('Properties', {}).get('Subnets', [])
+            subnet_ids = lb_data.get('SubnetIds') or (lb_data.get('Properties') or _EMPTY).get('Subnets') or []
             vpc_id = lb_data.get('VpcId')
             
             if subnet_ids:
                 # 最初のサブネットに配置
                 subnet_id = subnet_ids[0]
-                if subnet_id in reader.subnets:
-                    self.subnet_resources[subnet_id]['load_balancers'].append((lb_name, lb_data))
+                if subnet_id in subnets:
+                    subnet_resources[(subnet_id, 'load_balancers')].append((lb_name, lb_data, _display_label('load_balancers', lb_name, lb_data)))
                 elif vpc_id:
-                    self.vpc_resources[vpc_id]['load_balancers'].append((lb_name, lb_data))
+                    self._vpc_bucket(vpc_id)['load_balancers'].append((lb_name, lb_data))
                 else:
-                    self.external_resources['load_balancers'].append((lb_name, lb_data))
+                    external_resources['load_balancers'].append((lb_name, lb_data))
             elif vpc_id:
-                self.vpc_resources[vpc_id]['load_balancers'].append((lb_name, lb_data))
+                self._vpc_bucket(vpc_id)['load_balancers'].append((lb_name, lb_data))
             else:
-                self.external_resources['load_balancers'].append((lb_name, lb_data))
+                external_resources['load_balancers'].append((lb_name, lb_data))
         
         # Target Group -> VPC
         for tg_name, tg_data in reader.target_groups.items():
-            vpc_id = tg_data.get('VpcId') or tg_data.get('Properties', {}).get('VpcId')
-            if vpc_id and vpc_id in reader.vpcs:
-                self.vpc_resources[vpc_id]['target_groups'].append((tg_name, tg_data))
+            vpc_id = _field(tg_data, 'VpcId')
+            if vpc_id and vpc_id in vpcs:
+                self._vpc_bucket(vpc_id)['target_groups'].append((tg_name, tg_data))
             else:
-                self.external_resources['target_groups'].append((tg_name, tg_data))
+                external_resources['target_groups'].append((tg_name, tg_data))
         
         # 外部リソース
-        for bucket_name, bucket_data in reader.s3_buckets.items():
-            self.external_resources['s3'].append((bucket_name, bucket_data))
+        for reader_attr, bucket in self._EXTERNAL_DISPATCH:
+            external_resources[bucket].extend(getattr(reader, reader_attr).items())
         
-        for table_name, table_data in reader.dynamodb_tables.items():
-            self.external_resources['dynamodb'].append((table_name, table_data))
+        # バケットは追加時にだけ作られるため、キーのサブネットがそのまま「リソースあり」
+        self.subnet_has_resources.update(subnet_id for subnet_id, kind in subnet_resources)
         
-        for queue_name, queue_data in reader.sqs_queues.items():
-            self.external_resources['sqs'].append((queue_name, queue_data))
+        self._combine_subnet_resources()
+    
+    def _combine_subnet_resources(self):
+        """
+        しきい値を超えたバケットを集約ノード 1 件に置き換える
         
-        for topic_name, topic_data in reader.sns_topics.items():
-            self.external_resources['sns'].append((topic_name, topic_data))
+        描画時に件数で分岐せず、バケットの各要素をそのまま 1 ノードにできるようにする。
+        集約ノードは (f"{接頭辞}_{subnet_id}", {'Count': 件数}, ラベル)
+        """
+        subnet_resources = self.subnet_resources
+        self.subnet_resource_count = sum(len(res) for res in subnet_resources.values())
         
-        for fs_id, fs_data in reader.efs_filesystems.items():
-            self.external_resources['efs'].append((fs_id, fs_data))
+        for kind, prefix, label, threshold in self._COMBINE_RULES:
+            if threshold is None:
+                threshold = self.COMBINE_THRESHOLD
+            for subnet_id in self.subnet_has_resources:
+                res_list = subnet_resources.get((subnet_id, kind))
+                if res_list and len(res_list) > threshold:
+                    count = len(res_list)
+                    subnet_resources[(subnet_id, kind)] = [
+                        (f"{prefix}_{subnet_id}", {'Count': count}, label.format(count=count))
+                    ]
+    
+    def _vpc_bucket(self, vpc_id):
+        """VPC の集約リソース dict を取得（なければ作成）"""
+        return self.vpc_resources.setdefault(vpc_id, {'target_groups': [], 'load_balancers': []})
     
-    def generate(self, output_dir, output_name='aws-architecture'):
-        """アーキテクチャ図を生成"""
+    def _assign_to_subnet(self, source, bucket, field, is_list):
+        """
+        リソースをサブネットのバケットに振り分け
+        
+        Args:
+            source: reader のリソース dict
+            bucket: subnet_resources のキー
+            field: サブネットを示すフィールド名
+            is_list: True ならフィールドはサブネット ID のリスト（最初のサブネットに配置）
+        """
+        subnets = self.reader.subnets
+        subnet_resources = self.subnet_resources
+        
+        for res_id, res_data in source.items():
+            if is_list:
+                subnet_ids = res_data.get(field)
+                subnet_id = subnet_ids[0] if subnet_ids else None
+            else:
+                subnet_id = _field(res_data, field)
+            if subnet_id and subnet_id in subnets:
+                subnet_resources[(subnet_id, bucket)].append((res_id, res_data, _display_label(bucket, res_id, res_data)))
+    
+    def generate(self, output_dir, output_name='aws-architecture', output_format='png'):
+        """
+        アーキテクチャ図を生成
+        
+        出力ファイルと同じディレクトリに <output_name>.digest（リソースと描画オプションのハッシュ）を書き出し、
+        次回の呼び出しでハッシュが一致して出力ファイルも残っていれば再生成を省略する。
+        削除しても次回は常に再生成されるだけで、図には影響しない。
+        
+        Args:
+            output_dir: 出力ディレクトリ
+            output_name: 出力ファイル名（拡張子なし）
+            output_format: 出力形式（'png' など、またはそのリスト）。
+                'dot' の場合は Graphviz を起動せず DOT ソースのみを書き出す
+        
+        Returns:
+            生成したファイルのパス（output_format がリストの場合はパスのリスト）
+        """
         print("\n" + "=" * 80)
         print("Generating Architecture Diagram...")
         print("=" * 80 + "\n")
@@ -175,60 +588,210 @@ class ArchitectureDiagramGenerator:
         os.makedirs(output_dir, exist_ok=True)
         output_path = os.path.join(output_dir, output_name)
         
+        if isinstance(output_format, list):
+            output_files = [f"{output_path}.{fmt}" for fmt in output_format]
+        else:
+            output_files = [f"{output_path}.{output_format}"]
+        result = output_files if isinstance(output_format, list) else output_files[0]
+        
+        # リソースに変更がなく出力済みなら再生成しない
+        digest = self._state_digest(output_format)
+        digest_file = f"{output_path}.digest"
+        if all(os.path.exists(f) for f in output_files) and os.path.exists(digest_file):
+            with open(digest_file, 'r', encoding='utf-8') as f:
+                if f.read() == digest:
+                    for output_file in output_files:
+                        print(f"✓ Diagram unchanged, reusing: {output_file}")
+                    return result
+        
         # リソースを整理
         self._organize_resources()
         
+        if output_format == 'dot':
+            # レンダリングを省略して DOT ソースのみ出力
+            self._render(output_path, source_only=True)
+        else:
+            self._render(output_path, outformat=output_format)
+        
+        with open(digest_file, 'w', encoding='utf-8') as f:
+            f.write(digest)
+        
+        for output_file in output_files:
+            print(f"✓ Diagram generated: {output_file}")
+        return result
+    
+    def _state_digest(self, output_format):
+        """図の内容を決めるリソースと描画オプションのハッシュ"""
+        h = hashlib.blake2b(digest_size=16)
+        for attr in _DIGEST_ATTRS:
+            h.update(repr(getattr(self.reader, attr, None)).encode('utf-8'))
+        h.update(repr((output_format, self.graph_attr, self.fast, self.layout, self.renderer)).encode('utf-8'))
+        return h.hexdigest()
+    
+    @classmethod
+    def generate_many(cls, specs):
+        """
+        複数の図をまとめて生成（dot プロセスの起動は 1 回のみ）
+        
+        Args:
+            specs: (reader, output_dir, output_name) のイテラブル
+        
+        Returns:
+            生成した PNG ファイルパスのリスト
+        """
+        print("\n" + "=" * 80)
+        print("Generating Architecture Diagrams (batch)...")
+        print("=" * 80 + "\n")
+        
+        dot_files = []
+        for reader, output_dir, output_name in specs:
+            os.makedirs(output_dir, exist_ok=True)
+            output_path = os.path.join(output_dir, output_name)
+            
+            generator = cls(reader)
+            generator._organize_resources()
+            generator._render(output_path, source_only=True)
+            dot_files.append(f"{output_path}.dot")
+        
+        if not dot_files:
+            return []
+        
+        # すべての DOT を 1 回の dot 呼び出しでレンダリング（出力は <name>.dot.png）
+        subprocess.run([cls._dot_path(), '-Tpng', '-O', *dot_files], check=True)
+        
+        png_files = []
+        for dot_file in dot_files:
+            png_file = f"{dot_file[:-len('.dot')]}.png"
+            os.replace(f"{dot_file}.png", png_file)
+            os.remove(dot_file)
+            png_files.append(png_file)
+            print(f"✓ Diagram generated: {png_file}")
+        
+        return png_files
+    
+    @classmethod
+    def _dot_path(cls):
+        """dot バイナリのパスを取得（初回のみ PATH を検索）"""
+        if cls._dot_binary is None:
+            cls._dot_binary = shutil.which('dot') or 'dot'
+        return cls._dot_binary
+    
+    def _resource_count(self):
+        """図に載るリソース数（_organize_resources 後に使用）"""
+        count = self.subnet_resource_count
+        count += sum(len(res) for res in self.external_resources.values())
+        count += sum(len(res) for buckets in self.vpc_resources.values() for res in buckets.values())
+        return count
+    
+    def _graph_attr(self):
+        """Graphviz グラフ属性を決定"""
+        graph_attr = dict(self.GRAPH_ATTR)
+        graph_attr.update(self.graph_attr)
+        
+        fast = self.fast
+        if fast is None:
+            fast = self._resource_count() > self.FAST_LAYOUT_THRESHOLD
+        if fast:
+            # ortho は大規模グラフで最も遅いスプラインモード
+            graph_attr["splines"] = "polyline"
+        
+        if self.layout:
+            graph_attr["layout"] = self.layout
+        
+        return graph_attr
+    
+    def generate_per_vpc(self, output_dir, output_name='aws-architecture', max_workers=None):
+        """
+        VPC ごとの図を並列に生成（VPC ごとに 1 プロセス / 1 dot 起動）
+        
+        Args:
+            output_dir: 出力ディレクトリ
+            output_name: 出力ファイル名のプレフィックス（<output_name>-<vpc_id>.png）
+            max_workers: ワーカープロセス数（None で CPU 数）
+        
+        Returns:
+            生成した PNG ファイルパスのリスト
+        """
+        print("\n" + "=" * 80)
+        print("Generating Architecture Diagrams per VPC...")
+        print("=" * 80 + "\n")
+        
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # boto3 クライアントはプロセス間で受け渡せないため、描画に必要な属性だけを渡す
+        snapshot = SimpleNamespace(**{attr: getattr(self.reader, attr) for attr in _DIGEST_ATTRS})
+        options = {'graph_attr': self.graph_attr, 'fast': self.fast, 'layout': self.layout, 'renderer': self.renderer}
+        jobs = [
+            (snapshot, options, vpc_id, os.path.join(output_dir, f"{output_name}-{vpc_id}"))
+            for vpc_id in self.reader.vpcs
+        ]
+        
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            png_files = list(executor.map(_render_vpc_diagram, jobs))
+        
+        for png_file in png_files:
+            print(f"✓ Diagram generated: {png_file}")
+        return png_files
+    
+    def _render(self, output_path, source_only=False, outformat='png', vpc_ids=None):
+        """
+        図を構築してレンダリング
+        
+        source_only の場合は Graphviz を起動せず DOT ソースのみを書き出す。
+        vpc_ids を指定した場合はその VPC のみを描画する
+        """
         reader = self.reader
+        kit = _RENDERERS[self.renderer]
         
-        graph_attr = {
-            "fontsize": "14",
-            "bgcolor": "white",
-            "splines": "ortho",
-            "nodesep": "0.6",
-            "ranksep": "0.8",
-            "pad": "0.5",
-            "fontname": "Sans-Serif"
-        }
+        graph_attr = self._graph_attr()
+        diagram_cls = kit.SourceDiagram if source_only else kit.Diagram
         
-        with Diagram(
+        with diagram_cls(
             "AWS Architecture",
             filename=output_path,
             show=False,
             direction="TB",
+            outformat=outformat,
             graph_attr=graph_attr
         ):
             nodes = {}
             
             # VPC ごとにクラスターを作成
             for vpc_id, vpc_data in reader.vpcs.items():
+                if vpc_ids is not None and vpc_id not in vpc_ids:
+                    continue
+                
                 vpc_name = vpc_data.get('Name', vpc_id)
                 cidr = vpc_data.get('CidrBlock', '')
                 
                 # この VPC に属するサブネット
-                vpc_subnets = {
-                    sid: sdata for sid, sdata in reader.subnets.items()
-                    if (sdata.get('VpcId') or sdata.get('Properties', {}).get('VpcId')) == vpc_id
-                }
+                vpc_subnets = self.subnets_by_vpc.get(vpc_id, {})
                 
                 if not vpc_subnets:
                     continue
                 
-                with Cluster(
+                # リソースが 1 つもない VPC はクラスター（サブグラフ）を作らない
+                if not (self.vpc_resources.get(vpc_id) or
+                        not self.subnet_has_resources.isdisjoint(vpc_subnets)):
+                    continue
+                
+                with kit.Cluster(
                     f"{vpc_name}\n{cidr}",
                     graph_attr={"bgcolor": "#E3F2FD", "style": "rounded", "fontsize": "16"}
                 ):
                     # IGW
-                    for igw_id, igw_data in reader.internet_gateways.items():
-                        if igw_data.get('AttachedVpcId') == vpc_id:
-                            igw_name = igw_data.get('Name', igw_id)
-                            igw_node = InternetGateway(f"IGW\n{igw_name[:15]}")
-                            nodes[igw_id] = igw_node
+                    for igw_id, igw_label in self.igws_by_vpc.get(vpc_id, []):
+                        igw_node = kit.InternetGateway(igw_label)
+                        nodes[igw_id] = igw_node
                     
                     # サブネット（Public と Private で分類）
                     public_subnets = {}
                     private_subnets = {}
                     
                     for subnet_id, subnet_data in vpc_subnets.items():
+                        # 空のサブネットは描画しない
+                        if subnet_id not in self.subnet_has_resources:
+                            continue
                         is_public = subnet_data.get('IsPublic', False)
                         if is_public:
                             public_subnets[subnet_id] = subnet_data
@@ -237,7 +800,7 @@ class ArchitectureDiagramGenerator:
                     
                     # Public Subnets
                     if public_subnets:
-                        with Cluster(
+                        with kit.Cluster(
                             "Public Subnets",
                             graph_attr={"bgcolor": "#E8F5E9", "style": "dashed", "fontsize": "14"}
                         ):
@@ -246,7 +809,7 @@ class ArchitectureDiagramGenerator:
                     
                     # Private Subnets
                     if private_subnets:
-                        with Cluster(
+                        with kit.Cluster(
                             "Private Subnets",
                             graph_attr={"bgcolor": "#FFF3E0", "style": "dashed", "fontsize": "14"}
                         ):
@@ -254,20 +817,20 @@ class ArchitectureDiagramGenerator:
                                 self._create_subnet_cluster(subnet_id, subnet_data, nodes, is_public=False)
                     
                     # VPC レベルの集約リソース
-                    vpc_res = self.vpc_resources.get(vpc_id, {})
+                    vpc_res = self.vpc_resources.get(vpc_id, _EMPTY_VPC)
                     
                     # Target Groups（VPC 内）
-                    tg_list = vpc_res.get('target_groups', [])
+                    tg_list = vpc_res['target_groups']
                     if tg_list:
                         tg_count = len(tg_list)
-                        tg_node = ELB(f"Target Groups\n({tg_count})")
+                        tg_node = kit.ELB(f"Target Groups\n({tg_count})")
                         nodes[f'tg_vpc_{vpc_id}'] = tg_node
                     
                     # Load Balancers（サブネット指定なし）
-                    lb_list = vpc_res.get('load_balancers', [])
+                    lb_list = vpc_res['load_balancers']
                     if lb_list:
                         lb_count = len(lb_list)
-                        lb_node = ALB(f"Load Balancers\n({lb_count})")
+                        lb_node = kit.ALB(f"Load Balancers\n({lb_count})")
                         nodes[f'lb_vpc_{vpc_id}'] = lb_node
             
             # 外部リソース
@@ -283,75 +846,72 @@ class ArchitectureDiagramGenerator:
             )
             
             if external_count > 0:
-                with Cluster(
+                with kit.Cluster(
                     "External Services",
                     graph_attr={"bgcolor": "#F5F5F5", "style": "dashed", "fontsize": "14"}
                 ):
                     # S3
                     s3_count = len(self.external_resources['s3'])
                     if s3_count > 0:
-                        s3_node = S3(f"S3 Buckets\n({s3_count})")
+                        s3_node = kit.S3(f"S3 Buckets\n({s3_count})")
                         nodes['s3_combined'] = s3_node
                     
                     # DynamoDB
                     ddb_count = len(self.external_resources['dynamodb'])
                     if ddb_count > 0:
-                        ddb_node = Dynamodb(f"DynamoDB\n({ddb_count} tables)")
+                        ddb_node = kit.Dynamodb(f"DynamoDB\n({ddb_count} tables)")
                         nodes['dynamodb_combined'] = ddb_node
                     
                     # SQS
                     sqs_count = len(self.external_resources['sqs'])
                     if sqs_count > 0:
-                        sqs_node = SQS(f"SQS Queues\n({sqs_count})")
+                        sqs_node = kit.SQS(f"SQS Queues\n({sqs_count})")
                         nodes['sqs_combined'] = sqs_node
                     
                     # SNS
                     sns_count = len(self.external_resources['sns'])
                     if sns_count > 0:
-                        sns_node = SNS(f"SNS Topics\n({sns_count})")
+                        sns_node = kit.SNS(f"SNS Topics\n({sns_count})")
                         nodes['sns_combined'] = sns_node
                     
                     # EFS
                     efs_count = len(self.external_resources['efs'])
                     if efs_count > 0:
-                        efs_node = EFS(f"EFS\n({efs_count})")
+                        efs_node = kit.EFS(f"EFS\n({efs_count})")
                         nodes['efs_combined'] = efs_node
                     
                     # Lambda（VPC 外）
                     lambda_list = self.external_resources['lambda']
                     if lambda_list:
                         lambda_count = len(lambda_list)
-                        lambda_node = Lambda(f"Lambda\n({lambda_count} non-VPC)")
+                        lambda_node = kit.Lambda(f"Lambda\n({lambda_count} non-VPC)")
                         nodes['lambda_external'] = lambda_node
                     
                     # Target Groups（外部）
                     tg_list = self.external_resources['target_groups']
                     if tg_list:
                         tg_count = len(tg_list)
-                        tg_node = ELB(f"Target Groups\n({tg_count} external)")
+                        tg_node = kit.ELB(f"Target Groups\n({tg_count} external)")
                         nodes['tg_external'] = tg_node
                     
                     # Load Balancers（外部）
                     lb_list = self.external_resources['load_balancers']
                     if lb_list:
                         lb_count = len(lb_list)
-                        lb_node = ALB(f"Load Balancers\n({lb_count} external)")
+                        lb_node = kit.ALB(f"Load Balancers\n({lb_count} external)")
                         nodes['lb_external'] = lb_node
             
             # 関係を線で接続
             self._draw_relationships(nodes)
-        
-        print(f"✓ Diagram generated: {output_path}.png")
-        return f"{output_path}.png"
     
     def _create_subnet_cluster(self, subnet_id, subnet_data, nodes, is_public=False):
-        """サブネットのクラスターを作成"""
-        subnet_name = subnet_data.get('Name', subnet_id)
-        cidr = subnet_data.get('CidrBlock', '')
-        az = subnet_data.get('AvailabilityZone', '')
-        az_short = az[-2:] if az else ''
+        """サブネットのクラスターを作成（リソースがなければ何もしない）"""
+        if subnet_id not in self.subnet_has_resources:
+            return
         
-        subnet_label = f"{subnet_name[:20]}\n{cidr}\n({az_short})"
+        kit = _RENDERERS[self.renderer]
+        subnet_resources = self.subnet_resources
+        subnet_label = self.subnet_labels[subnet_id]
         
         # サブネットタイプで背景色を変える
         if is_public:
@@ -361,7 +921,7 @@ class ArchitectureDiagramGenerator:
             bg_color = "#FFE0B2"
             subnet_icon = PrivateSubnet
         
-        with Cluster(
+        with kit.Cluster(
             subnet_label,
             graph_attr={"bgcolor": bg_color, "style": "rounded", "fontsize": "12"}
         ):
@@ -369,144 +929,51 @@ class ArchitectureDiagramGenerator:
             # subnet_node = subnet_icon(f"")
             # nodes[subnet_id] = subnet_node
             
-            resources = self.subnet_resources.get(subnet_id, {})
-            
             # NAT Gateway
-            for nat_id, nat_data in resources.get('nat_gateways', []):
-                nat_name = nat_data.get('Name', nat_id)
-                nat_node = NATGateway(f"NAT\n{nat_name[:10]}")
+            for nat_id, nat_data, nat_label in subnet_resources.get((subnet_id, 'nat_gateways'), ()):
+                nat_node = kit.NATGateway(nat_label)
                 nodes[nat_id] = nat_node
             
-            # Load Balancer
-            lb_list = resources.get('load_balancers', [])
-            if lb_list:
-                lb_count = len(lb_list)
-                if lb_count == 1:
-                    lb_name = lb_list[0][0]
-                    lb_data = lb_list[0][1]
-                    lb_type = lb_data.get('LoadBalancerType', 'application')
-                    icon = ALB if lb_type == 'application' else NLB
-                    lb_node = icon(f"{lb_name[:15]}")
-                    nodes[lb_name] = lb_node
-                else:
-                    lb_node = ALB(f"Load Balancers\n({lb_count})")
-                    nodes[f'lb_{subnet_id}'] = lb_node
+            # Load Balancer（集約ノードは ALB アイコン）
+            for lb_name, lb_data, lb_label in subnet_resources.get((subnet_id, 'load_balancers'), ()):
+                lb_type = lb_data.get('LoadBalancerType', 'application')
+                icon = kit.ALB if lb_type == 'application' else kit.NLB
+                lb_node = icon(lb_label)
+                nodes[lb_name] = lb_node
             
             # VPC Endpoint（1サブネットに1つだけ）
-            ep_list = resources.get('vpc_endpoints', [])
-            if ep_list:
-                ep_id, ep_data = ep_list[0]
-                service_name = ep_data.get('ServiceName', '')
-                # サービス名を短縮
-                short_service = service_name.split('.')[-1] if '.' in service_name else service_name
-                ep_node = Endpoint(f"Endpoint\n{short_service[:12]}")
+            for ep_id, ep_data, ep_label in subnet_resources.get((subnet_id, 'vpc_endpoints'), ()):
+                ep_node = kit.Endpoint(ep_label)
                 nodes[ep_id] = ep_node
             
-            # EC2
-            ec2_list = resources.get('ec2', [])
-            if ec2_list:
-                ec2_count = len(ec2_list)
-                if ec2_count <= 2:
-                    for ec2_id, ec2_data in ec2_list:
-                        ec2_name = ec2_data.get('Name', ec2_id)
-                        ec2_node = EC2(f"{ec2_name[:15]}")
-                        nodes[ec2_id] = ec2_node
-                else:
-                    ec2_node = EC2(f"EC2\n({ec2_count} instances)")
-                    nodes[f'ec2_{subnet_id}'] = ec2_node
-            
-            # ECS Services
-            ecs_list = resources.get('ecs_services', [])
-            if ecs_list:
-                ecs_count = len(ecs_list)
-                if ecs_count <= 2:
-                    for svc_name, svc_data in ecs_list:
-                        svc_node = Fargate(f"{svc_name[:15]}")
-                        nodes[svc_name] = svc_node
-                else:
-                    svc_node = Fargate(f"ECS Services\n({ecs_count})")
-                    nodes[f'ecs_{subnet_id}'] = svc_node
-            
-            # EKS Clusters
-            eks_list = resources.get('eks_clusters', [])
-            if eks_list:
-                eks_count = len(eks_list)
-                if eks_count <= 2:
-                    for cluster_name, cluster_data in eks_list:
-                        eks_node = EKS(f"{cluster_name[:15]}")
-                        nodes[cluster_name] = eks_node
-                else:
-                    eks_node = EKS(f"EKS Clusters\n({eks_count})")
-                    nodes[f'eks_{subnet_id}'] = eks_node
-            
-            # Lambda (VPC)
-            lambda_list = resources.get('lambda', [])
-            if lambda_list:
-                lambda_count = len(lambda_list)
-                if lambda_count <= 2:
-                    for func_name, func_data in lambda_list:
-                        func_node = Lambda(f"{func_name[:15]}")
-                        nodes[func_name] = func_node
-                else:
-                    func_node = Lambda(f"Lambda\n({lambda_count} VPC)")
-                    nodes[f'lambda_{subnet_id}'] = func_node
-            
-            # RDS
-            rds_list = resources.get('rds', [])
-            if rds_list:
-                rds_count = len(rds_list)
-                if rds_count <= 2:
-                    for db_id, db_data in rds_list:
-                        db_node = RDS(f"{db_id[:15]}")
-                        nodes[db_id] = db_node
-                else:
-                    db_node = RDS(f"RDS\n({rds_count} instances)")
-                    nodes[f'rds_{subnet_id}'] = db_node
-            
-            # 何もリソースがない場合は Blank を表示
-            has_resources = any([
-                resources.get('nat_gateways'),
-                resources.get('load_balancers'),
-                resources.get('vpc_endpoints'),
-                resources.get('ec2'),
-                resources.get('ecs_services'),
-                resources.get('eks_clusters'),
-                resources.get('lambda'),
-                resources.get('rds'),
-            ])
-            
-            if not has_resources:
-                # 空のサブネットには空白ノードを表示
-                blank_node = Blank("")
-                nodes[f'blank_{subnet_id}'] = blank_node
+            # EC2 / ECS Services / EKS Clusters / Lambda (VPC) / RDS
+            # （しきい値を超えたものは _organize_resources で集約済み）
+            for kind, icon_name in self._SUBNET_NODE_ICONS:
+                res_list = subnet_resources.get((subnet_id, kind))
+                if res_list:
+                    icon = getattr(kit, icon_name)
+                    for res_id, res_data, res_label in res_list:
+                        nodes[res_id] = icon(res_label)
     
     def _draw_relationships(self, nodes):
         """リソース間の関係を線で描画"""
         reader = self.reader
-        
-        edge_colors = {
-            'attached_to': ('blue', 'bold', ''),
-            'belongs_to': ('gray', 'dashed', ''),
-            'in_subnet': ('green', 'solid', ''),
-            'in_vpc': ('blue', 'dotted', ''),
-            'in_cluster': ('purple', 'solid', ''),
-            'routes_to': ('red', 'solid', ''),
-            'targets': ('red', 'dashed', 'targets'),
-            'triggers': ('orange', 'bold', 'trigger'),
-        }
+        kit = _RENDERERS[self.renderer]
         
         drawn_edges = set()
+        edges = {}
         
-        for source_id, target_id, rel_type, label in reader.relationships:
-            # ノードが存在するかチェック
-            source_node = nodes.get(source_id)
-            target_node = nodes.get(target_id)
-            
-            if source_node and target_node:
+        # 図に存在するノードを起点に関係を引く（関係全体の走査を避ける）
+        rel_by_source = self.rel_by_source
+        for source_id, source_node in nodes.items():
+            for target_id, rel_type, label in rel_by_source.get(source_id, ()):
+                target_node = nodes.get(target_id)
+                if not target_node:
+                    continue
+                
                 edge_key = (source_id, target_id, rel_type)
                 if edge_key not in drawn_edges:
-                    color, style, edge_label = edge_colors.get(rel_type, ('gray', 'solid', ''))
-                    source_node >> Edge(color=color, style=style, label=edge_label) >> target_node
+                    source_node >> _edge(edges, kit, *_EDGE_STYLES.get(rel_type, _DEFAULT_EDGE_STYLE)) >> target_node
                     drawn_edges.add(edge_key)
         
         # IGW と最初のリソースの接続（オプション）
@@ -516,58 +983,83 @@ class ArchitectureDiagramGenerator:
         #         pass
         
         # Load Balancer -> EC2/ECS の接続
+        # VPC ごとに最初のノード化済み EC2 / ECS サービスを 1 回だけ求めておく
+        # サブネットの集約 EC2 ノード（ec2_<subnet_id>）があればそちらを優先し、
+        # 集約ノードがまとめているインスタンス数だけをラベルに表示する
+        ec2_by_vpc = {}
+        combined_ec2_by_vpc = {}
+        combined_ec2_count = defaultdict(int)
+        for ec2_id, ec2_data in reader.ec2_instances.items():
+            ec2_vpc_id = ec2_data.get('VpcId')
+            if ec2_id in nodes:
+                ec2_by_vpc.setdefault(ec2_vpc_id, ec2_id)
+                continue
+            node_key = f"ec2_{_field(ec2_data, 'SubnetId')}"
+            if node_key in nodes:
+                combined_ec2_by_vpc.setdefault(ec2_vpc_id, node_key)
+                combined_ec2_count[node_key] += 1
+        
+        ecs_by_vpc = {}
+        for svc_name, svc_data in reader.ecs_services.items():
+            if svc_name in nodes:
+                # ECS サービスは VpcId を持たないため配置先サブネットから VPC を解決
+                subnet_ids = svc_data.get('SubnetIds', [])
+                subnet_data = reader.subnets.get(subnet_ids[0], _EMPTY) if subnet_ids else _EMPTY
+                svc_vpc_id = _field(subnet_data, 'VpcId')
+                ecs_by_vpc.setdefault(svc_vpc_id, svc_name)
+        
         for lb_name, lb_data in reader.load_balancers.items():
             if lb_name in nodes:
                 vpc_id = lb_data.get('VpcId')
                 if vpc_id:
                     # EC2 に接続
-                    for ec2_id, ec2_data in reader.ec2_instances.items():
-                        if ec2_data.get('VpcId') == vpc_id and ec2_id in nodes:
-                            edge_key = (lb_name, ec2_id, 'lb_ec2')
-                            if edge_key not in drawn_edges:
-                                nodes[lb_name] >> Edge(color="red", style="dashed") >> nodes[ec2_id]
-                                drawn_edges.add(edge_key)
-                                break
+                    ec2_id = combined_ec2_by_vpc.get(vpc_id) or ec2_by_vpc.get(vpc_id)
+                    if ec2_id:
+                        edge_key = (lb_name, ec2_id, 'lb_ec2')
+                        if edge_key not in drawn_edges:
+                            # 集約ノードへは 1 本にまとめ、件数をラベルに表示（個別ノードはラベルなし）
+                            ec2_count = combined_ec2_count.get(ec2_id, 0)
+                            edge_label = f"{ec2_count} instances" if ec2_count > 1 else ''
+                            nodes[lb_name] >> _edge(edges, kit, "red", "dashed", edge_label) >> nodes[ec2_id]
+                            drawn_edges.add(edge_key)
                     
                     # ECS に接続
-                    for svc_name, svc_data in reader.ecs_services.items():
-                        if svc_name in nodes:
-                            edge_key = (lb_name, svc_name, 'lb_ecs')
-                            if edge_key not in drawn_edges:
-                                nodes[lb_name] >> Edge(color="red", style="dashed") >> nodes[svc_name]
-                                drawn_edges.add(edge_key)
-                                break
-        
-        # Lambda -> DynamoDB
-        if 'dynamodb_combined' in nodes:
-            for func_name, func_data in reader.lambda_functions.items():
-                if func_name in nodes:
-                    edge_key = (func_name, 'dynamodb_combined', 'lambda_ddb')
-                    if edge_key not in drawn_edges:
-                        nodes[func_name] >> Edge(color="orange", style="dotted") >> nodes['dynamodb_combined']
-                        drawn_edges.add(edge_key)
-                        break
-        
-        # Lambda -> S3
-        if 's3_combined' in nodes:
-            for func_name, func_data in reader.lambda_functions.items():
+                    svc_name = ecs_by_vpc.get(vpc_id)
+                    if svc_name:
+                        edge_key = (lb_name, svc_name, 'lb_ecs')
+                        if edge_key not in drawn_edges:
+                            nodes[lb_name] >> _edge(edges, kit, "red", "dashed") >> nodes[svc_name]
+                            drawn_edges.add(edge_key)
+        
+        # 集約ノード間の接続（Lambda -> DynamoDB/S3、SNS/SQS -> Lambda）
+        # source が None のルールは「ノード化済みの最初の Lambda」を起点にする
+        # （Lambda ごとに線を引かず 1 本にまとめ、件数をラベルに表示）
+        first_func = None
+        func_count = 0
+        if any(rule[0] is None and rule[1] in nodes for rule in _COMBINED_EDGE_RULES):
+            for func_name in reader.lambda_functions:
                 if func_name in nodes:
-                    edge_key = (func_name, 's3_combined', 'lambda_s3')
-                    if edge_key not in drawn_edges:
-                        nodes[func_name] >> Edge(color="purple", style="dotted") >> nodes['s3_combined']
-                        drawn_edges.add(edge_key)
-                        break
-        
-        # SNS -> Lambda トリガー
-        if 'sns_combined' in nodes and 'lambda_external' in nodes:
-            edge_key = ('sns_combined', 'lambda_external', 'sns_trigger')
-            if edge_key not in drawn_edges:
-                nodes['sns_combined'] >> Edge(color="orange", style="bold", label="trigger") >> nodes['lambda_external']
-                drawn_edges.add(edge_key)
+                    if first_func is None:
+                        first_func = func_name
+                    func_count += 1
         
-        # SQS -> Lambda トリガー
-        if 'sqs_combined' in nodes and 'lambda_external' in nodes:
-            edge_key = ('sqs_combined', 'lambda_external', 'sqs_trigger')
+        for source_id, target_id, kind, color, style, label in _COMBINED_EDGE_RULES:
+            if source_id is None:
+                source_id = first_func
+                if func_count > 1:
+                    label = f"{func_count} funcs"
+            if source_id not in nodes or target_id not in nodes:
+                continue
+            edge_key = (source_id, target_id, kind)
             if edge_key not in drawn_edges:
-                nodes['sqs_combined'] >> Edge(color="orange", style="bold", label="trigger") >> nodes['lambda_external']
+                nodes[source_id] >> _edge(edges, kit, color, style, label) >> nodes[target_id]
                 drawn_edges.add(edge_key)
+
+
+def _render_vpc_diagram(job):
+    """1 VPC 分の図を生成（ProcessPoolExecutor のワーカー）"""
+    reader, options, vpc_id, output_path = job
+    generator = ArchitectureDiagramGenerator(reader, **options)
+    generator._organize_resources()
+    generator._render(output_path, vpc_ids={vpc_id})
+    return f"{output_path}.png"
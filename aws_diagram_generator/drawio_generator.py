@@ -5,11 +5,102 @@ AWS 公式アイコンスタイルを使用
 """
 
 import os
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+import sys
 from collections import defaultdict
-import base64
-import urllib.parse
+from xml.sax.saxutils import escape
+
+try:
+    # lxml があれば xmlfile でセルを 1 つずつファイルへ逐次書き出す（なければ文字列テンプレートで出力）
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+# AWS アイコンスタイルの共通部分（末尾に shape=<アイコン>; と追加スタイルが続く）
+_ICON_STYLE_PREFIX = 'sketch=0;points=[[0,0,0],[0.25,0,0],[0.5,0,0],[0.75,0,0],[1,0,0],[0,1,0],[0.25,1,0],[0.5,1,0],[0.75,1,0],[1,1,0],[0,0.25,0],[0,0.5,0],[0,0.75,0],[1,0.25,0],[1,0.5,0],[1,0.75,0]];outlineConnect=0;fontColor=#232F3E;gradientColor=#F78E04;gradientDirection=north;fillColor=#D05C17;strokeColor=#ffffff;dashed=0;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;fontSize=12;fontStyle=0;aspect=fixed;'
+
+
+# EKS コンテナ内の Pod アイコン
+_POD_STYLE = 'sketch=0;html=1;aspect=fixed;strokeColor=none;shadow=0;fillColor=#326CE5;verticalAlign=top;labelPosition=center;verticalLabelPosition=bottom;shape=mxgraph.kubernetes.icon2;prIcon=pod;'
+
+
+# 接続線の既定スタイル
+_EDGE_STYLE = 'edgeStyle=orthogonalEdgeStyle;rounded=0;orthogonalLoop=1;jettySize=auto;html=1;strokeColor=#000000;strokeWidth=2;'
+
+
+# 属性値のエスケープ（ElementTree と同じく改行・タブも文字参照にする）
+_ATTR_ENTITIES = {'"': '&quot;', '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'}
+
+# mxCell の出力テンプレート（インデントは ElementTree.indent と同じ）
+_CELL_TEMPLATE = (
+    '        <mxCell id="%s" value="%s" style="%s" parent="%s" vertex="1"%s>\n'
+    '          <mxGeometry x="%s" y="%s" width="%s" height="%s" as="geometry" />\n'
+    '        </mxCell>\n'
+)
+_EDGE_TEMPLATE = (
+    '        <mxCell id="%s" style="%s" parent="%s" edge="1" source="%s" target="%s">\n'
+    '          <mxGeometry relative="1" as="geometry" />\n'
+    '        </mxCell>\n'
+)
+
+
+def _attrs_str(attrs):
+    """属性 dict を XML の属性列（先頭に空白付き）に変換"""
+    return ''.join(f' {key}="{escape(value, _ATTR_ENTITIES)}"' for key, value in attrs.items())
+
+
+# 座標 / サイズの文字列表現（レイアウトの値は種類が少ないため、値ごとに 1 回だけ str() する）
+_NUM_STR = {}
+
+
+def _num_str(value):
+    """数値を文字列に変換（キャッシュ付き）"""
+    text = _NUM_STR.get(value)
+    if text is None:
+        text = _NUM_STR[value] = str(value)
+    return text
+
+
+def _push(buckets, key, item):
+    """buckets[key] のリストに追加（なければ作成。defaultdict のファクトリ呼び出しを避ける）"""
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = []
+    bucket.append(item)
+
+
+class _Cell:
+    """
+    頂点セル（図形 / コンテナ）
+    
+    x / y / width / height は文字列で保持し、connectable はコンテナのみ '0'、それ以外は None
+    """
+    
+    __slots__ = ('id', 'value', 'x', 'y', 'width', 'height', 'style', 'parent', 'connectable')
+    
+    def __init__(self, id, value, x, y, width, height, style, parent, connectable=None):
+        self.id = id
+        self.value = value
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.style = style
+        self.parent = parent
+        self.connectable = connectable
+
+
+class _EdgeCell:
+    """エッジセル（接続線）"""
+    
+    __slots__ = ('id', 'source', 'target', 'style', 'parent')
+    
+    def __init__(self, id, source, target, style, parent):
+        self.id = id
+        self.source = source
+        self.target = target
+        self.style = style
+        self.parent = parent
 
 
 class DrawioGenerator:
@@ -76,6 +167,16 @@ class DrawioGenerator:
         'Region': 'mxgraph.aws4.region',
     }
     
+    # サブネットへの振り分け: (reader の属性, アイコン, フィールド, リストか)
+    # リストの場合は最初のサブネットに配置
+    _SUBNET_DISPATCH = (
+        ('ec2_instances', 'EC2', 'SubnetId', False),
+        ('ecs_services', 'Fargate', 'SubnetIds', True),
+        ('eks_clusters', 'EKS', 'SubnetIds', True),
+        ('lambda_functions', 'Lambda', 'SubnetIds', True),
+        ('rds_instances', 'RDS', 'SubnetIds', True),
+    )
+    
     # 色の定義
     COLORS = {
         'aws_cloud': '#232F3E',
@@ -88,6 +189,42 @@ class DrawioGenerator:
         'container': '#ED7100',
     }
     
+    # _aws_icon_style の結果: (icon_type, extra_style) -> スタイル文字列
+    _STYLE_CACHE = {}
+    
+    # _container_style の結果: (color, dashed) -> スタイル文字列
+    _CONTAINER_STYLE_CACHE = {}
+    
+    # mxfile / diagram / mxGraphModel 要素の属性
+    MXFILE_ATTRS = {
+        'host': 'app.diagrams.net',
+        'modified': '2024-01-01T00:00:00.000Z',
+        'agent': 'AWS Architecture Generator',
+        'version': '1.0',
+        'type': 'device',
+    }
+    DIAGRAM_ATTRS = {
+        'id': 'aws-architecture',
+        'name': 'AWS Architecture',
+    }
+    GRAPH_MODEL_ATTRS = {
+        'dx': '0',
+        'dy': '0',
+        'grid': '1',
+        'gridSize': '10',
+        'guides': '1',
+        'tooltips': '1',
+        'connect': '1',
+        'arrows': '1',
+        'fold': '1',
+        'page': '1',
+        'pageScale': '1',
+        'pageWidth': '1600',
+        'pageHeight': '1200',
+        'math': '0',
+        'shadow': '0',
+    }
+    
     def __init__(self, reader):
         """
         Args:
@@ -96,10 +233,15 @@ class DrawioGenerator:
         self.reader = reader
         self.cell_id = 2  # 0 と 1 は予約
         self.cells = []
+        self.cell_count = 0  # self.cells の使用済み要素数（事前確保分を除く）
         self.edges = []
         
-        # サブネットごとのリソース
-        self.subnet_resources = defaultdict(list)
+        # サブネットごとのリソース（subnet_id -> [(アイコン, リソース ID, データ)]）
+        self.subnet_resources = {}
+        
+        # VPC ID -> [(subnet_id, subnet_data)] / [(igw_id, igw_data)]
+        self.subnets_by_vpc = defaultdict(list)
+        self.igws_by_vpc = defaultdict(list)
         
         # 位置計算用
         self.current_x = 0
@@ -113,97 +255,88 @@ class DrawioGenerator:
     def _create_cell(self, value, x, y, width, height, style, parent='1'):
         """セルを作成"""
         cell_id = self._next_id()
-        cell = {
-            'id': cell_id,
-            'value': value,
-            'x': x,
-            'y': y,
-            'width': width,
-            'height': height,
-            'style': style,
-            'parent': parent,
-            'vertex': '1'
-        }
-        self.cells.append(cell)
+        self._add_cell(_Cell(
+            cell_id, value, _num_str(x), _num_str(y), _num_str(width), _num_str(height), style, parent
+        ))
         return cell_id
     
     def _create_group(self, value, x, y, width, height, style, parent='1'):
         """グループ（コンテナ）を作成"""
         cell_id = self._next_id()
-        cell = {
-            'id': cell_id,
-            'value': value,
-            'x': x,
-            'y': y,
-            'width': width,
-            'height': height,
-            'style': style,
-            'parent': parent,
-            'vertex': '1',
-            'connectable': '0'
-        }
-        self.cells.append(cell)
+        self._add_cell(_Cell(
+            cell_id, value, _num_str(x), _num_str(y), _num_str(width), _num_str(height), style, parent,
+            connectable='0'
+        ))
         return cell_id
     
+    def _add_cell(self, cell):
+        """事前確保した self.cells の次の位置にセルを格納（足りなければ追加）"""
+        count = self.cell_count
+        if count < len(self.cells):
+            self.cells[count] = cell
+        else:
+            self.cells.append(cell)
+        self.cell_count = count + 1
+    
     def _create_edge(self, source, target, style=''):
         """エッジ（接続線）を作成"""
         edge_id = self._next_id()
-        edge = {
-            'id': edge_id,
-            'source': source,
-            'target': target,
-            'style': style or 'edgeStyle=orthogonalEdgeStyle;rounded=0;orthogonalLoop=1;jettySize=auto;html=1;strokeColor=#000000;strokeWidth=2;',
-            'edge': '1',
-            'parent': '1'
-        }
-        self.edges.append(edge)
+        self.edges.append(_EdgeCell(edge_id, source, target, sys.intern(style) if style else _EDGE_STYLE, '1'))
         return edge_id
     
     def _aws_icon_style(self, icon_type, extra_style=''):
-        """AWS アイコンのスタイルを生成"""
-        icon = self.AWS_ICONS.get(icon_type, 'mxgraph.aws4.resourceIcon')
-        style = f'sketch=0;points=[[0,0,0],[0.25,0,0],[0.5,0,0],[0.75,0,0],[1,0,0],[0,1,0],[0.25,1,0],[0.5,1,0],[0.75,1,0],[1,1,0],[0,0.25,0],[0,0.5,0],[0,0.75,0],[1,0.25,0],[1,0.5,0],[1,0.75,0]];outlineConnect=0;fontColor=#232F3E;gradientColor=#F78E04;gradientDirection=north;fillColor=#D05C17;strokeColor=#ffffff;dashed=0;verticalLabelPosition=bottom;verticalAlign=top;align=center;html=1;fontSize=12;fontStyle=0;aspect=fixed;shape={icon};{extra_style}'
+        """AWS アイコンのスタイルを生成（(アイコン, 追加スタイル) ごとにキャッシュ）"""
+        key = (icon_type, extra_style)
+        style = self._STYLE_CACHE.get(key)
+        if style is None:
+            icon = self.AWS_ICONS.get(icon_type, 'mxgraph.aws4.resourceIcon')
+            style = sys.intern(f'{_ICON_STYLE_PREFIX}shape={icon};{extra_style}')
+            self._STYLE_CACHE[key] = style
         return style
     
     def _container_style(self, color, dashed=False):
-        """コンテナのスタイルを生成"""
-        dash = 'dashed=1;dashPattern=8 8;' if dashed else 'dashed=0;'
-        style = f'rounded=1;arcSize=10;{dash}strokeColor={color};strokeWidth=2;fillColor=none;fontColor={color};fontStyle=1;verticalAlign=top;align=left;spacingLeft=10;spacingTop=5;html=1;'
+        """コンテナのスタイルを生成（(色, 破線か) ごとにキャッシュ）"""
+        key = (color, dashed)
+        style = self._CONTAINER_STYLE_CACHE.get(key)
+        if style is None:
+            dash = 'dashed=1;dashPattern=8 8;' if dashed else 'dashed=0;'
+            style = sys.intern(f'rounded=1;arcSize=10;{dash}strokeColor={color};strokeWidth=2;fillColor=none;fontColor={color};fontStyle=1;verticalAlign=top;align=left;spacingLeft=10;spacingTop=5;html=1;')
+            self._CONTAINER_STYLE_CACHE[key] = style
         return style
     
     def _organize_resources(self):
-        """リソースをサブネットごとに整理"""
-        reader = self.reader
-        
-        # EC2 -> Subnet
-        for ec2_id, ec2_data in reader.ec2_instances.items():
-            subnet_id = ec2_data.get('SubnetId') or ec2_data.get('Properties', {}).get('SubnetId')
-            if subnet_id:
-                self.subnet_resources[subnet_id].append(('EC2', ec2_id, ec2_data))
-        
-        # ECS Service -> Subnet
-        for svc_name, svc_data in reader.ecs_services.items():
-            subnet_ids = svc_data.get('SubnetIds', [])
-            if subnet_ids:
-                self.subnet_resources[subnet_ids[0]].append(('Fargate', svc_name, svc_data))
-        
-        # EKS Cluster -> Subnet
-        for cluster_name, cluster_data in reader.eks_clusters.items():
-            subnet_ids = cluster_data.get('SubnetIds', [])
-            if subnet_ids:
-                self.subnet_resources[subnet_ids[0]].append(('EKS', cluster_name, cluster_data))
-        
-        # Lambda (VPC) -> Subnet
-        for func_name, func_data in reader.lambda_functions.items():
-            subnet_ids = func_data.get('SubnetIds', [])
-            if subnet_ids:
-                self.subnet_resources[subnet_ids[0]].append(('Lambda', func_name, func_data))
+        """
+        リソースをサブネットごとに整理
         
-        # RDS -> Subnet
-        for db_id, db_data in reader.rds_instances.items():
-            subnet_ids = db_data.get('SubnetIds', [])
-            if subnet_ids:
-                self.subnet_resources[subnet_ids[0]].append(('RDS', db_id, db_data))
+        バケットは描画時にサブネットごとに取り出して破棄するため、呼び出しのたびに作り直す
+        """
+        reader = self.reader
+        self.subnet_resources = subnet_resources = {}
+        self.subnets_by_vpc = subnets_by_vpc = defaultdict(list)
+        
+        # Subnet -> VPC（VPC ごとにサブネット全体を走査しないよう 1 回だけ索引化）
+        for subnet_id, subnet_data in reader.subnets.items():
+            vpc_id = subnet_data.get('VpcId') or subnet_data.get('Properties', {}).get('VpcId')
+            if vpc_id:
+                subnets_by_vpc[vpc_id].append((subnet_id, subnet_data))
+        
+        # IGW -> VPC
+        self.igws_by_vpc = igws_by_vpc = defaultdict(list)
+        for igw_id, igw_data in reader.internet_gateways.items():
+            vpc_id = igw_data.get('AttachedVpcId')
+            if vpc_id:
+                igws_by_vpc[vpc_id].append((igw_id, igw_data))
+        
+        # EC2 / ECS / EKS / Lambda (VPC) / RDS -> Subnet
+        for reader_attr, icon, field, is_list in self._SUBNET_DISPATCH:
+            for res_id, res_data in getattr(reader, reader_attr).items():
+                if is_list:
+                    subnet_ids = res_data.get(field)
+                    subnet_id = subnet_ids[0] if subnet_ids else None
+                else:
+                    subnet_id = res_data.get(field) or res_data.get('Properties', {}).get(field)
+                if subnet_id:
+                    _push(subnet_resources, subnet_id, (icon, res_id, res_data))
         
         # Load Balancer -> Subnet
         for lb_name, lb_data in reader.load_balancers.items():
@@ -211,13 +344,13 @@ class DrawioGenerator:
             if subnet_ids:
                 lb_type = lb_data.get('LoadBalancerType', 'application')
                 icon = 'ALB' if lb_type == 'application' else 'NLB'
-                self.subnet_resources[subnet_ids[0]].append((icon, lb_name, lb_data))
+                _push(subnet_resources, subnet_ids[0], (icon, lb_name, lb_data))
         
-        # NAT Gateway -> Subnet
+        # NAT Gateway -> Subnet（サブネット内では Load Balancer の後に並べる）
         for nat_id, nat_data in reader.nat_gateways.items():
             subnet_id = nat_data.get('SubnetId') or nat_data.get('Properties', {}).get('SubnetId')
             if subnet_id:
-                self.subnet_resources[subnet_id].append(('NATGateway', nat_id, nat_data))
+                _push(subnet_resources, subnet_id, ('NATGateway', nat_id, nat_data))
         
         # VPC Endpoint -> Subnet（1つだけ）
         endpoint_added = set()
@@ -225,7 +358,7 @@ class DrawioGenerator:
             subnet_ids = ep_data.get('SubnetIds', []) or ep_data.get('Properties', {}).get('SubnetIds', [])
             for subnet_id in subnet_ids:
                 if subnet_id not in endpoint_added:
-                    self.subnet_resources[subnet_id].append(('VPCEndpoint', ep_id, ep_data))
+                    _push(subnet_resources, subnet_id, ('VPCEndpoint', ep_id, ep_data))
                     endpoint_added.add(subnet_id)
                     break
     
@@ -246,6 +379,13 @@ class DrawioGenerator:
         # レイアウト計算
         layout = self._calculate_layout()
         
+        # セルのリストを見積もり数だけ事前確保（append による再確保を避ける）
+        # 同じインスタンスで generate を繰り返しても前回のセル・エッジ・ID を持ち越さない
+        self.cells = [None] * layout['estimated_cells']
+        self.cell_count = 0
+        self.edges = []
+        self.cell_id = 2
+        
         # AWS Cloud コンテナ
         cloud_id = self._create_group(
             'AWS Cloud',
@@ -273,23 +413,21 @@ class DrawioGenerator:
         # VPC ごとに描画
         vpc_y = 60
         node_map = {}  # リソース ID -> セル ID のマッピング
+        igw_cells = []  # 描画した IGW のセル ID（接続線用）
         
         for vpc_id, vpc_data in reader.vpcs.items():
             vpc_name = vpc_data.get('Name', vpc_id)
             cidr = vpc_data.get('CidrBlock', '')
             
             # この VPC のサブネットを取得
-            vpc_subnets = {
-                sid: sdata for sid, sdata in reader.subnets.items()
-                if (sdata.get('VpcId') or sdata.get('Properties', {}).get('VpcId')) == vpc_id
-            }
+            vpc_subnets = self.subnets_by_vpc.get(vpc_id)
             
             if not vpc_subnets:
                 continue
             
             # AZ ごとにサブネットを分類
             az_subnets = defaultdict(list)
-            for subnet_id, subnet_data in vpc_subnets.items():
+            for subnet_id, subnet_data in vpc_subnets:
                 az = subnet_data.get('AvailabilityZone', 'unknown')
                 az_subnets[az].append((subnet_id, subnet_data))
             
@@ -315,15 +453,15 @@ class DrawioGenerator:
             )
             
             # IGW を描画
-            for igw_id, igw_data in reader.internet_gateways.items():
-                if igw_data.get('AttachedVpcId') == vpc_id:
-                    igw_cell = self._create_cell(
-                        'IGW',
-                        30, vpc_y + 50, 48, 48,
-                        self._aws_icon_style('InternetGateway'),
-                        region_id
-                    )
-                    node_map[igw_id] = igw_cell
+            for igw_id, igw_data in self.igws_by_vpc.get(vpc_id, ()):
+                igw_cell = self._create_cell(
+                    'IGW',
+                    30, vpc_y + 50, 48, 48,
+                    self._aws_icon_style('InternetGateway'),
+                    region_id
+                )
+                node_map[igw_id] = igw_cell
+                igw_cells.append(igw_cell)
             
             # AZ ごとに描画
             az_y = 60
@@ -367,12 +505,14 @@ class DrawioGenerator:
                     )
                     node_map[subnet_id] = subnet_cell_id
                     
-                    # サブネット内のリソースを描画
-                    res_x = 20
-                    res_y = 40
+                    # サブネット内のリソースを描画（4 列 x 60px のグリッド、slot は左上からの通し番号）
+                    slot = 0
                     
-                    for res_type, res_id, res_data in self.subnet_resources.get(subnet_id, []):
-                        res_name = res_data.get('Name', res_id)[:15] if isinstance(res_data, dict) else str(res_id)[:15]
+                    # 描画したバケットは不要になるので取り出して破棄する
+                    for res_type, res_id, res_data in self.subnet_resources.pop(subnet_id, ()):
+                        row, col = divmod(slot, 4)
+                        res_x = 20 + col * 60
+                        res_y = 40 + row * 60
                         
                         # EKS の場合は特別処理
                         if res_type == 'EKS':
@@ -401,18 +541,15 @@ class DrawioGenerator:
                                 eks_abs_x + 60, eks_abs_y + 30, 40, 40,
                                 self._aws_icon_style('Fargate')
                             )
-                            self._create_cell(
-                                'pod',
-                                eks_abs_x + 110, eks_abs_y + 30, 30, 30,
-                                'sketch=0;html=1;aspect=fixed;strokeColor=none;shadow=0;fillColor=#326CE5;verticalAlign=top;labelPosition=center;verticalLabelPosition=bottom;shape=mxgraph.kubernetes.icon2;prIcon=pod;'
-                            )
-                            self._create_cell(
-                                'pod',
-                                eks_abs_x + 145, eks_abs_y + 30, 30, 30,
-                                'sketch=0;html=1;aspect=fixed;strokeColor=none;shadow=0;fillColor=#326CE5;verticalAlign=top;labelPosition=center;verticalLabelPosition=bottom;shape=mxgraph.kubernetes.icon2;prIcon=pod;'
-                            )
+                            for pod_dx in (110, 145):
+                                self._create_cell(
+                                    'pod',
+                                    eks_abs_x + pod_dx, eks_abs_y + 30, 30, 30,
+                                    _POD_STYLE
+                                )
                             
-                            res_x += 200
+                            # EKS コンテナ（幅 180）は行の残りを占有し、次のリソースは次の行から
+                            slot += 4 - col
                         else:
                             cell_id = self._create_cell(
                                 res_type if res_type in ['ALB', 'NLB', 'EC2'] else '',
@@ -420,11 +557,7 @@ class DrawioGenerator:
                                 self._aws_icon_style(res_type)
                             )
                             node_map[res_id] = cell_id
-                            res_x += 60
-                        
-                        if res_x > 240:
-                            res_x = 20
-                            res_y += 60
+                            slot += 1
                     
                     subnet_x += 320
                 
@@ -566,19 +699,18 @@ class DrawioGenerator:
         )
         
         # 接続線を追加
-        # IGW -> VPC 内のリソース
-        for igw_id, igw_cell in [(k, v) for k, v in node_map.items() if 'igw' in k.lower()]:
-            for lb_name, lb_data in reader.load_balancers.items():
-                if lb_name in node_map:
-                    self._create_edge(igw_cell, node_map[lb_name])
-                    break
+        # IGW -> VPC 内のリソース（描画済みの最初の Load Balancer に接続）
+        if igw_cells:
+            lb_cell = next((node_map[lb_name] for lb_name in reader.load_balancers if lb_name in node_map), None)
+            if lb_cell:
+                for igw_cell in igw_cells:
+                    self._create_edge(igw_cell, lb_cell)
         
-        # XML を生成
-        xml_content = self._generate_xml()
+        # 見積もりより少なかった分の未使用要素を除く
+        del self.cells[self.cell_count:]
         
-        # ファイルに書き込み
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(xml_content)
+        # XML をファイルに書き出し
+        self._write_xml(output_path)
         
         print(f"✓ Draw.io diagram generated: {output_path}")
         return output_path
@@ -593,14 +725,11 @@ class DrawioGenerator:
         max_azs = 0
         
         for vpc_id, vpc_data in reader.vpcs.items():
-            vpc_subnets = {
-                sid: sdata for sid, sdata in reader.subnets.items()
-                if (sdata.get('VpcId') or sdata.get('Properties', {}).get('VpcId')) == vpc_id
-            }
+            vpc_subnets = self.subnets_by_vpc.get(vpc_id, ())
             max_subnets = max(max_subnets, len(vpc_subnets))
             
             az_set = set()
-            for sid, sdata in vpc_subnets.items():
+            for sid, sdata in vpc_subnets:
                 az = sdata.get('AvailabilityZone', '')
                 if az:
                     az_set.add(az)
@@ -615,6 +744,14 @@ class DrawioGenerator:
         cloud_width = region_width + 400
         cloud_height = region_height + 200
         
+        # セル数の上限の見積もり
+        # 固定分（AWS Cloud / Region / 外部サービス）+ VPC ごとに 2 + IGW + AZ とサブネット（最大でサブネット数の 2 倍）
+        # + サブネット内のリソース（EKS は Fargate と Pod 2 つの追加 4 セル）
+        estimated_cells = (
+            17 + num_vpcs * 2 + len(reader.internet_gateways) + len(reader.subnets) * 2
+            + sum(len(res) for res in self.subnet_resources.values()) + len(reader.eks_clusters) * 4
+        )
+        
         return {
             'vpc_width': vpc_width,
             'vpc_height': vpc_height,
@@ -622,89 +759,104 @@ class DrawioGenerator:
             'region_height': region_height,
             'cloud_width': cloud_width,
             'cloud_height': cloud_height,
+            'estimated_cells': estimated_cells,
         }
     
+    def _write_xml(self, output_path):
+        """Draw.io XML をファイルに書き出す"""
+        if etree is not None:
+            self._stream_xml(output_path)
+            return
+        
+        # 1 回だけエンコードして os.write で直接書き込む
+        data = memoryview(self._generate_xml().encode('utf-8'))
+        # Windows でも改行を変換しないようバイナリモードで開く
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        fd = os.open(output_path, flags, 0o644)
+        try:
+            # 通常は 1 回で書き終わるが、部分書き込みに備えて残りがあれば続ける
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+    
     def _generate_xml(self):
-        """Draw.io XML を生成"""
-        # ルート要素
-        mxfile = ET.Element('mxfile')
-        mxfile.set('host', 'app.diagrams.net')
-        mxfile.set('modified', '2024-01-01T00:00:00.000Z')
-        mxfile.set('agent', 'AWS Architecture Generator')
-        mxfile.set('version', '1.0')
-        mxfile.set('type', 'device')
-        
-        # diagram 要素
-        diagram = ET.SubElement(mxfile, 'diagram')
-        diagram.set('id', 'aws-architecture')
-        diagram.set('name', 'AWS Architecture')
-        
-        # mxGraphModel 要素
-        graph_model = ET.SubElement(diagram, 'mxGraphModel')
-        graph_model.set('dx', '0')
-        graph_model.set('dy', '0')
-        graph_model.set('grid', '1')
-        graph_model.set('gridSize', '10')
-        graph_model.set('guides', '1')
-        graph_model.set('tooltips', '1')
-        graph_model.set('connect', '1')
-        graph_model.set('arrows', '1')
-        graph_model.set('fold', '1')
-        graph_model.set('page', '1')
-        graph_model.set('pageScale', '1')
-        graph_model.set('pageWidth', '1600')
-        graph_model.set('pageHeight', '1200')
-        graph_model.set('math', '0')
-        graph_model.set('shadow', '0')
-        
-        # root 要素
-        root = ET.SubElement(graph_model, 'root')
-        
-        # 基本セル
-        cell0 = ET.SubElement(root, 'mxCell')
-        cell0.set('id', '0')
+        """
+        Draw.io XML を生成
         
-        cell1 = ET.SubElement(root, 'mxCell')
-        cell1.set('id', '1')
-        cell1.set('parent', '0')
+        要素の木は作らず、整形済みの文字列片をリストに追加して最後に 1 回だけ連結する
+        """
+        parts = [
+            "<?xml version='1.0' encoding='utf-8'?>\n",
+            f"<mxfile{_attrs_str(self.MXFILE_ATTRS)}>\n",
+            f"  <diagram{_attrs_str(self.DIAGRAM_ATTRS)}>\n",
+            f"    <mxGraphModel{_attrs_str(self.GRAPH_MODEL_ATTRS)}>\n",
+            "      <root>\n",
+            # 基本セル
+            '        <mxCell id="0" />\n',
+            '        <mxCell id="1" parent="0" />\n',
+        ]
+        append = parts.append
         
         # セルを追加
         for cell in self.cells:
-            mx_cell = ET.SubElement(root, 'mxCell')
-            mx_cell.set('id', cell['id'])
-            mx_cell.set('value', cell['value'])
-            mx_cell.set('style', cell['style'])
-            mx_cell.set('parent', cell['parent'])
-            mx_cell.set('vertex', cell.get('vertex', '1'))
-            
-            if cell.get('connectable') == '0':
-                mx_cell.set('connectable', '0')
-            
-            # geometry
-            geometry = ET.SubElement(mx_cell, 'mxGeometry')
-            geometry.set('x', str(cell['x']))
-            geometry.set('y', str(cell['y']))
-            geometry.set('width', str(cell['width']))
-            geometry.set('height', str(cell['height']))
-            geometry.set('as', 'geometry')
+            append(_CELL_TEMPLATE % (
+                cell.id, escape(cell.value, _ATTR_ENTITIES), escape(cell.style, _ATTR_ENTITIES), cell.parent,
+                ' connectable="0"' if cell.connectable == '0' else '',
+                cell.x, cell.y, cell.width, cell.height,
+            ))
         
         # エッジを追加
         for edge in self.edges:
-            mx_cell = ET.SubElement(root, 'mxCell')
-            mx_cell.set('id', edge['id'])
-            mx_cell.set('style', edge['style'])
-            mx_cell.set('parent', edge['parent'])
-            mx_cell.set('edge', '1')
-            mx_cell.set('source', edge['source'])
-            mx_cell.set('target', edge['target'])
-            
-            geometry = ET.SubElement(mx_cell, 'mxGeometry')
-            geometry.set('relative', '1')
-            geometry.set('as', 'geometry')
+            append(_EDGE_TEMPLATE % (
+                edge.id, escape(edge.style, _ATTR_ENTITIES), edge.parent, edge.source, edge.target,
+            ))
         
-        # XML を文字列に変換
-        xml_str = ET.tostring(mxfile, encoding='unicode')
+        parts.append("      </root>\n    </mxGraphModel>\n  </diagram>\n</mxfile>")
+        return ''.join(parts)
+    
+    def _stream_xml(self, output_path):
+        """
+        lxml の xmlfile で Draw.io XML を書き出す
         
-        # 整形
-        dom = minidom.parseString(xml_str)
-        return dom.toprettyxml(indent='  ')
+        文書全体の文字列は作らず、mxCell を 1 つずつ要素にして書き出す（大規模環境でのメモリ使用量を抑える）
+        """
+        with etree.xmlfile(output_path, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element('mxfile', self.MXFILE_ATTRS):
+                with xf.element('diagram', self.DIAGRAM_ATTRS):
+                    with xf.element('mxGraphModel', self.GRAPH_MODEL_ATTRS):
+                        with xf.element('root'):
+                            for mx_cell in self._iter_mx_cells():
+                                xf.write(mx_cell, pretty_print=True)
+    
+    def _iter_mx_cells(self):
+        """root 直下の mxCell 要素を順に生成（属性は set() を繰り返さず dict でまとめて渡す）"""
+        element = etree.Element
+        sub_element = etree.SubElement
+        
+        # 基本セル
+        yield element('mxCell', {'id': '0'})
+        yield element('mxCell', {'id': '1', 'parent': '0'})
+        
+        # セルを追加
+        for cell in self.cells:
+            attrib = {'id': cell.id, 'value': cell.value, 'style': cell.style, 'parent': cell.parent, 'vertex': '1'}
+            if cell.connectable == '0':
+                attrib['connectable'] = '0'
+            mx_cell = element('mxCell', attrib)
+            sub_element(mx_cell, 'mxGeometry', {
+                'x': cell.x, 'y': cell.y,
+                'width': cell.width, 'height': cell.height,
+                'as': 'geometry',
+            })
+            yield mx_cell
+        
+        # エッジを追加
+        for edge in self.edges:
+            mx_cell = element('mxCell', {
+                'id': edge.id, 'style': edge.style, 'parent': edge.parent,
+                'edge': '1', 'source': edge.source, 'target': edge.target,
+            })
+            sub_element(mx_cell, 'mxGeometry', {'relative': '1', 'as': 'geometry'})
+            yield mx_cell
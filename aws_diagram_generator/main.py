@@ -31,14 +31,21 @@ AWS アーキテクチャ図生成器 V3
 
 import os
 import argparse
+import atexit
+import contextlib
+import functools
+import importlib
+import importlib.util
+import queue
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='AWS アーキテクチャ図生成器 V3',
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="""
+# コマンドラインヘルプ
+_DESCRIPTION = 'AWS アーキテクチャ図生成器 V3'
+
+_EPILOG = """
 使用例:
     # AWS から直接読み取って図を生成
     python main.py
@@ -58,6 +65,211 @@ def main():
     # 図の生成をスキップ（CloudFormation エクスポートのみ）
     python main.py --export-cf --no-diagram
 """
+
+# バナーの区切り線
+_RULE = "=" * 80
+
+# --from-cf では読み込まないはずの AWS SDK モジュール（--debug-imports で検査）
+_AWS_SDK_MODULES = ('boto3', 'botocore')
+
+# 出力形式 -> (モジュール名, クラス名)。モジュールは選ばれた形式のものだけを読み込む
+_GENERATORS = {
+    'drawio': ('drawio_generator', 'DrawioGenerator'),  # Draw.io 形式（AWS 公式アイコンスタイル）
+    'svg': ('svg_generator', 'SVGGenerator'),  # SVG 形式
+    'svg_sg': ('svg_generator', 'SecurityGroupSVGGenerator'),  # Security Group SVG 形式
+    'png': ('diagram_generator', 'ArchitectureDiagramGenerator'),  # PNG 形式（diagrams ライブラリ使用）
+}
+
+# モジュール -> 必要な外部パッケージ ((import 名, pip パッケージ名), ...)
+_REQUIREMENTS = {
+    'aws_reader': (('boto3', 'boto3'),),
+    'cf_exporter': (('yaml', 'pyyaml'),),
+    'diagram_generator': (('diagrams', 'diagrams'),),
+}
+
+# find_spec の結果のキャッシュ: import 名 -> 見つかったか
+_SPEC_CACHE = {}
+
+# ライブラリとして import された場合の遅延再エクスポート: 名前 -> モジュール名
+_LAZY_EXPORTS = {
+    'AWSResourceReader': 'aws_reader',
+    'CloudFormationImporter': 'cf_exporter',
+    'export_cloudformation': 'cf_exporter',
+    'export_cloudformation_stream': 'cf_exporter',
+    'ArchitectureDiagramGenerator': 'diagram_generator',
+    'DrawioGenerator': 'drawio_generator',
+    'SVGGenerator': 'svg_generator',
+}
+
+
+def __getattr__(name):
+    """main.DrawioGenerator などを初回参照時に読み込む（PEP 562）"""
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _load(module_name, name)
+
+
+class _ImportProfiler:
+    """
+    --profile-imports 用の meta path finder
+    
+    他の finder が返した spec のローダーの exec_module を計測用に差し替え、
+    モジュールごとの読み込み時間（累積 / 自身のみ）を記録する。
+    """
+    
+    # 終了時に表示する件数
+    TOP_N = 30
+    
+    def __init__(self):
+        self.timings = []  # (累積 ns, 自身のみ ns, モジュール名)
+        self._child_ns = []  # 読み込み中のモジュールごとの、子モジュールの読み込み時間
+    
+    def install(self):
+        sys.meta_path.insert(0, self)
+        atexit.register(self.report)
+    
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        
+        # BuiltinImporter などクラス自体がローダーの場合は差し替えない
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, 'exec_module'):
+            loader.exec_module = self._timed(fullname, loader.exec_module)
+        return spec
+    
+    def _timed(self, fullname, exec_module):
+        def timed_exec_module(module):
+            self._child_ns.append(0)
+            start = time.perf_counter_ns()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                child = self._child_ns.pop()
+                if self._child_ns:
+                    self._child_ns[-1] += elapsed
+                self.timings.append((elapsed, elapsed - child, fullname))
+        return timed_exec_module
+    
+    def report(self):
+        lines = [f"\nImport times (top {self.TOP_N}, cumulative / self):"]
+        for cumulative, own, fullname in sorted(self.timings, reverse=True)[:self.TOP_N]:
+            lines.append(f"  {cumulative / 1e6:9.1f} ms  {own / 1e6:9.1f} ms  {fullname}")
+        sys.stderr.write("\n".join(lines) + "\n")
+
+
+def _have(name):
+    """パッケージがインストールされているかを import せずに確認（結果はキャッシュ）"""
+    found = _SPEC_CACHE.get(name)
+    if found is None:
+        found = _SPEC_CACHE[name] = importlib.util.find_spec(name) is not None
+    return found
+
+
+def _check_requirements(*module_names):
+    """モジュールが必要とする外部パッケージが揃っているか確認。不足があればメッセージを表示して False"""
+    missing = []
+    for module_name in module_names:
+        for import_name, package in _REQUIREMENTS.get(module_name, ()):
+            if not _have(import_name) and package not in missing:
+                missing.append(package)
+    if missing:
+        print(f"\nERROR: Required package(s) not installed: {', '.join(missing)}")
+        print(f"  pip install {' '.join(missing)}")
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def _block_imports(names):
+    """
+    names のモジュールを sys.modules で None にして import を失敗させる
+    
+    既に読み込み済みのモジュールには触れず、終了時に追加したエントリだけを取り除く
+    （同じプロセスで run を繰り返したり、後から import したりできるようにする）
+    """
+    blocked = [name for name in names if name not in sys.modules]
+    for name in blocked:
+        sys.modules[name] = None
+    try:
+        yield
+    finally:
+        for name in blocked:
+            if name in sys.modules and sys.modules[name] is None:
+                del sys.modules[name]
+
+
+def _load(module_name, attr):
+    """モジュールを読み込んで属性を取得"""
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _parse_page_sizes(values):
+    """--per-service-page-size の SERVICE=N のリストを辞書に変換"""
+    page_sizes = {}
+    for value in values:
+        service, sep, size = value.partition('=')
+        if not sep or not service or not size.isdigit():
+            raise ValueError(f"--per-service-page-size: invalid value {value!r} (expected SERVICE=N)")
+        page_sizes[service.strip().lower()] = int(size)
+    return page_sizes
+
+
+def _make_output_dirs(*paths):
+    """出力先ディレクトリをまとめて作成（None は無視）。失敗した場合は False"""
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            print(f"\nERROR: Failed to create output directory: {e}")
+            return False
+    return True
+
+
+def _read_parallel(reader, max_workers, cf_dir=None):
+    """
+    AWS リソースを並列に読み取る
+    
+    cf_dir が指定されている場合は、読み取りが完了したサービスから順に
+    別スレッドで CloudFormation を書き出す。
+    
+    Returns:
+        (読み取ったリソース数, 書き出しで発生した例外。cf_dir がない場合や成功した場合は None)
+        読み取りの例外はそのまま送出し、書き出しの例外とは区別して呼び出し元で報告させる
+    """
+    if cf_dir is None:
+        return reader.read_all_resources_parallel(max_workers=max_workers), None
+    
+    export_cloudformation_stream = _load('cf_exporter', 'export_cloudformation_stream')
+    
+    done_queue = queue.Queue()
+    with ThreadPoolExecutor(max_workers=1) as exporter:
+        export = exporter.submit(export_cloudformation_stream, reader, cf_dir, done_queue)
+        try:
+            total = reader.read_all_resources_parallel(max_workers=max_workers, done_queue=done_queue)
+        finally:
+            done_queue.put(None)
+        # 書き出しの完了を待ち、失敗していればその例外を返す
+        return total, export.exception()
+
+
+@functools.lru_cache(maxsize=1)
+def _build_parser():
+    """コマンドライン引数のパーサーを作成（一度だけ作成して再利用）"""
+    parser = argparse.ArgumentParser(
+        description=_DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=_EPILOG
     )
     
     parser.add_argument(
@@ -85,6 +297,30 @@ def main():
         help='AssumeRole 時のセッション名 (default: AWSArchitectureDiagramGenerator)'
     )
     
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=16,
+        metavar='N',
+        help='AWS API の並列読み取り数（1 で逐次読み取り） (default: 16)'
+    )
+    
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=1000,
+        metavar='N',
+        help='AWS API の 1 ページあたりの取得件数（各 API の上限で切り詰め） (default: 1000)'
+    )
+    
+    parser.add_argument(
+        '--per-service-page-size',
+        action='append',
+        default=[],
+        metavar='SERVICE=N',
+        help='サービスごとの取得件数（例: ec2=1000、複数指定可）'
+    )
+    
     parser.add_argument(
         '--output-dir',
         default='aws-outputs',
@@ -118,16 +354,38 @@ def main():
         help='アーキテクチャ図生成をスキップ'
     )
     
-    parser.add_argument(
+    # 出力形式（旧来の --drawio / --svg / --svg-sg は --format の別名）
+    format_group = parser.add_mutually_exclusive_group()
+    
+    format_group.add_argument(
+        '--format',
+        choices=list(_GENERATORS),
+        default='png',
+        help='出力形式 (default: png)'
+    )
+    
+    format_group.add_argument(
         '--drawio',
-        action='store_true',
-        help='Draw.io 形式で出力（AWS 公式アイコンスタイル）'
+        action='store_const',
+        dest='format',
+        const='drawio',
+        help='Draw.io 形式で出力（AWS 公式アイコンスタイル、--format drawio と同じ）'
     )
     
-    parser.add_argument(
+    format_group.add_argument(
         '--svg',
-        action='store_true',
-        help='SVG 形式で出力'
+        action='store_const',
+        dest='format',
+        const='svg',
+        help='SVG 形式で出力（--format svg と同じ）'
+    )
+    
+    format_group.add_argument(
+        '--svg-sg',
+        action='store_const',
+        dest='format',
+        const='svg_sg',
+        help='Security Group 関係の SVG 図を出力（--format svg_sg と同じ）'
     )
     
     parser.add_argument(
@@ -137,33 +395,96 @@ def main():
     )
     
     parser.add_argument(
-        '--svg-sg',
+        '--profile-imports',
+        action='store_true',
+        help='モジュールごとの読み込み時間を計測し、終了時に標準エラーへ表示'
+    )
+    
+    parser.add_argument(
+        '--debug-imports',
         action='store_true',
-        help='Security Group 関係の SVG 図を出力'
+        help='--from-cf 時に boto3/botocore を読み込もうとしたらエラーにし、終了時に読み込み状況を表示'
     )
     
-    args = parser.parse_args()
+    return parser
+
+
+def run(argv=None):
+    """
+    コマンドラインを実行して終了コードを返す
+    
+    Args:
+        argv: コマンドライン引数のリスト（省略時は sys.argv[1:]）
+    """
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    
+    if args.profile_imports:
+        _ImportProfiler().install()
+    
+    try:
+        page_sizes = _parse_page_sizes(args.per_service_page_size)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    # 作業ディレクトリに依存する値は起動時に一度だけ求める
+    args.output_dir_abs = os.path.abspath(args.output_dir)
     
-    print("\n" + "=" * 80)
-    print("AWS Architecture Diagram Generator V3")
-    print("=" * 80)
-    print(f"Output Directory: {args.output_dir}")
+    # run の前から読み込み済みの AWS SDK モジュール（--debug-imports の検査対象から除く）
+    args.sdk_preloaded = [name for name in _AWS_SDK_MODULES if sys.modules.get(name) is not None]
+    
+    if args.from_cf and args.debug_imports:
+        # CloudFormation からの読み込みでは AWS SDK は不要。誤って import した箇所で ImportError にする
+        with _block_imports(_AWS_SDK_MODULES):
+            return _run(args, page_sizes)
+    return _run(args, page_sizes)
+
+
+def _run(args, page_sizes):
+    """解析済みの引数で読み込みと図の生成を行い、終了コードを返す"""
+    # バナーはまとめて 1 回で書き出す
+    banner = [
+        "",
+        _RULE,
+        "AWS Architecture Diagram Generator V3",
+        _RULE,
+        f"Output Directory: {args.output_dir}",
+    ]
     
     if args.from_cf:
-        print(f"Mode: Import from CloudFormation")
-        print(f"CloudFormation Directory: {args.from_cf}")
+        banner.append("Mode: Import from CloudFormation")
+        banner.append(f"CloudFormation Directory: {args.from_cf}")
     else:
-        print(f"Mode: Read from AWS API")
-        print(f"Region: {args.region}")
+        banner.append("Mode: Read from AWS API")
+        banner.append(f"Region: {args.region}")
         if args.role_arn:
-            print(f"IAM Role: {args.role_arn}")
+            banner.append(f"IAM Role: {args.role_arn}")
+    
+    banner.append(_RULE + "\n\n")
+    sys.stdout.write("\n".join(banner))
     
-    print("=" * 80 + "\n")
+    # 出力先ディレクトリ（生成器・エクスポーターは作成済みのディレクトリに書き出す）
+    diagram_dir = None if args.no_diagram else os.path.join(args.output_dir, 'diagrams')
+    cf_dir = None
+    if args.export_cf is not None and not args.from_cf:
+        cf_dir = args.export_cf or os.path.join(args.output_dir, 'cloudformation')
+    
+    # 必要なパッケージを重い import の前に確認
+    if args.from_cf:
+        required = ['cf_exporter']
+    else:
+        required = ['aws_reader']
+        if cf_dir is not None:
+            required.append('cf_exporter')
+    if diagram_dir is not None:
+        required.append(_GENERATORS[args.format][0])
+    if not _check_requirements(*required):
+        return 1
     
     # リソースを読み込む
     if args.from_cf:
         # CloudFormation からインポート
-        from cf_exporter import CloudFormationImporter
+        CloudFormationImporter = _load('cf_exporter', 'CloudFormationImporter')
         
         reader = CloudFormationImporter()
         total = reader.import_from_directory(args.from_cf)
@@ -171,77 +492,90 @@ def main():
         if total == 0:
             print("\n⚠ No resources found. Check the directory path.")
             return 1
+        
+        if not _make_output_dirs(diagram_dir):
+            return 1
     else:
         # AWS API から読み込み
-        from aws_reader import AWSResourceReader
+        AWSResourceReader = _load('aws_reader', 'AWSResourceReader')
+        
+        # 対応していないサービス名（ec3=500 などの打ち間違い）は無視せずエラーにする
+        # （aws_reader の読み込みが必要なため、引数の解析時ではなくここで検査する）
+        unknown_services = sorted(set(page_sizes) - set(AWSResourceReader._PAGE_SIZE_PARAMS))
+        if unknown_services:
+            _build_parser().error(
+                f"--per-service-page-size: unknown service {', '.join(unknown_services)} "
+                f"(choices: {', '.join(AWSResourceReader._PAGE_SIZE_PARAMS)})"
+            )
+        
+        # 書き込めない場合は時間のかかる AWS の読み取りより前に失敗させる
+        if not _make_output_dirs(diagram_dir, cf_dir):
+            return 1
         
         try:
             reader = AWSResourceReader(
                 region=args.region,
                 role_arn=args.role_arn,
                 external_id=args.external_id,
-                session_name=args.session_name
+                session_name=args.session_name,
+                page_size=args.page_size,
+                page_sizes=page_sizes
             )
-            total = reader.read_all_resources()
+            export_error = None
+            if args.max_workers > 1:
+                total, export_error = _read_parallel(reader, args.max_workers, cf_dir)
+            else:
+                total = reader.read_all_resources()
         except Exception as e:
             print(f"\nERROR: Failed to read AWS resources: {e}")
             return 1
         
+        if export_error is not None:
+            print(f"\nERROR: Failed to export CloudFormation: {export_error}")
+            return 1
+        
         if total == 0:
             print("\n⚠ No resources found. Check your credentials and region.")
             return 1
         
-        # CloudFormation エクスポート
-        if args.export_cf is not None:
-            from cf_exporter import export_cloudformation
-            
-            # エクスポート先を決定
-            if args.export_cf:
-                cf_dir = args.export_cf
-            else:
-                cf_dir = os.path.join(args.output_dir, 'cloudformation')
-            
+        # CloudFormation エクスポート（逐次読み取り時。並列読み取り時は読み取りと並行して書き出し済み）
+        if cf_dir is not None and args.max_workers <= 1:
+            export_cloudformation = _load('cf_exporter', 'export_cloudformation')
             export_cloudformation(reader, cf_dir)
     
     # アーキテクチャ図生成
-    if not args.no_diagram:
-        diagram_dir = os.path.join(args.output_dir, 'diagrams')
-        
-        if args.drawio:
-            # Draw.io 形式で出力
-            from drawio_generator import DrawioGenerator
-            
-            generator = DrawioGenerator(reader)
-            generator.generate(diagram_dir, args.output_name)
-        
-        elif args.svg:
-            # SVG 形式で出力
-            from svg_generator import SVGGenerator
-            
-            generator = SVGGenerator(reader, icons_dir=args.icons_dir)
-            generator.generate(diagram_dir, args.output_name)
-        
-        elif args.svg_sg:
-            # Security Group SVG 形式で出力
-            from svg_generator import SecurityGroupSVGGenerator
-            
-            generator = SecurityGroupSVGGenerator(reader)
-            generator.generate(diagram_dir, args.output_name)
+    if diagram_dir is not None:
+        module_name, class_name = _GENERATORS[args.format]
+        generator_cls = _load(module_name, class_name)
         
+        if args.format == 'svg':
+            generator = generator_cls(reader, icons_dir=args.icons_dir)
         else:
-            # PNG 形式で出力（diagrams ライブラリ使用）
-            from diagram_generator import ArchitectureDiagramGenerator
-            
-            generator = ArchitectureDiagramGenerator(reader)
-            generator.generate(diagram_dir, args.output_name)
+            generator = generator_cls(reader)
+        generator.generate(diagram_dir, args.output_name)
     
-    print("\n" + "=" * 80)
-    print("Complete!")
-    print(f"Output directory: {os.path.abspath(args.output_dir)}")
-    print("=" * 80 + "\n")
+    sys.stdout.write(
+        f"\n{_RULE}\n"
+        "Complete!\n"
+        f"Output directory: {args.output_dir_abs}\n"
+        f"{_RULE}\n\n"
+    )
+    
+    if args.debug_imports:
+        loaded = [name for name in _AWS_SDK_MODULES if sys.modules.get(name) is not None]
+        sys.stdout.write(f"AWS SDK modules loaded: {', '.join(loaded) or 'none'}\n")
+        # --from-cf の実行中に新たに読み込まれていたら失敗として扱う
+        newly_loaded = [name for name in loaded if name not in args.sdk_preloaded]
+        if args.from_cf and newly_loaded:
+            print(f"\nERROR: AWS SDK modules were loaded in --from-cf mode: {', '.join(newly_loaded)}")
+            return 1
     
     return 0
 
 
+def main():
+    return run()
+
+
 if __name__ == '__main__':
-    sys.exit(main())
+    raise SystemExit(run())
@@ -9,12 +9,125 @@ SVG 形式のアーキテクチャ図生成モジュール
 """
 
 import os
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict, namedtuple
+from itertools import product
+from xml.sax.saxutils import escape
 import math
 import re
 import base64
 
 
+# デフォルトアイコンの <path> 要素。線のスタイルは親の <g> に指定する
+# サブパスは 1 つの d 属性にまとめる（塗りなしなので描画は同じ）
+_ICON_PATH = '<path d="%s"/>\n'
+_ICON_STROKE = 'fill="none" stroke="white" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"'
+
+# アイコン・接続線の SVG テンプレート（str.format で埋める）
+# アイコンの図形はアイコン種別・サイズごとに <defs> の <symbol> に 1 回だけ出力し、各ノードは <use> で参照する
+_SYMBOL_TEMPLATE = '''    <symbol id="{symbol_id}" viewBox="0 0 {size} {size}">
+{body}
+    </symbol>
+'''
+
+_FILE_ICON_BODY = '''<g transform="scale({scale:.4f})">
+{inner}
+</g>'''
+
+_DEFAULT_ICON_BODY = '''<rect x="0" y="0" width="{size}" height="{size}" rx="4" fill="{bg}"/>
+<g transform="scale({scale:.3f})" ''' + _ICON_STROKE + '''>
+{paths}</g>'''
+
+# ノード数に比例して出力されるため、インデントは付けない
+# アイコン種別・サイズごとに symbol_id と size だけを str.format で埋めておき、ノードごとには
+# res_id, x, y, ラベルを % で埋める
+_ICON_USE_TEMPLATE = '''<g id="%s" transform="translate(%d,%d)">
+<use xlink:href="#{symbol_id}" width="{size}" height="{size}"/>
+%s</g>
+'''
+
+# ラベル 1 行分の開始タグ（アイコンサイズと行番号で位置が決まる）
+_LABEL_PREFIX = '<text x="{}" y="{}" text-anchor="middle" fill="#333" font-size="9">'
+
+# 凡例の 1 項目（アイコンとサービス名）。% で埋める
+# アイコンは図中と同じ <symbol> を縮小して参照する（viewBox があるので width/height に合わせて拡縮される）
+_LEGEND_ICON = '    <use xlink:href="#%s" x="%d" y="%d" width="%d" height="%d"/>\n'
+_LEGEND_LABEL = '    <text x="%d" y="%d" fill="#333" font-size="9">%s</text>\n'
+
+# 接続線（座標は整数なので %d で埋める）。線のスタイルは _build_svg_document で囲む <g> に指定する
+_EDGE_TEMPLATE = '<line x1="%d" y1="%d" x2="%d" y2="%d"/>\n'
+
+
+# 所属を表すだけの関係（階層で表現するので接続線にはしない）。reader は関係の種類を小文字で出力する
+_STRUCTURAL_REL_TYPES = frozenset(('belongs_to', 'in_vpc', 'in_subnet'))
+
+# SVG 文書の固定部分（_build_svg_document で % により埋める）
+# 並び: _SVG_HEAD, アイコンの <symbol>, _SVG_DEFS, _SVG_TITLE, 凡例, 本文, _SVG_EDGES_OPEN, 接続線, _SVG_EDGES_CLOSE, _SVG_TAIL
+_SVG_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
+     width="%d" height="%d" 
+     viewBox="0 0 %d %d"
+     style="background-color: white; font-family: Arial, sans-serif;">
+  
+  <defs>
+'''
+
+_SVG_DEFS = '''    <marker id="arrowhead" markerWidth="8" markerHeight="6" refX="7" refY="3" orient="auto">
+      <polygon points="0 0, 8 3, 0 6" fill="#222"/>
+    </marker>
+    <pattern id="smallGrid" width="%(grid)d" height="%(grid)d" patternUnits="userSpaceOnUse">
+      <path d="M %(grid)d 0 L 0 0 0 %(grid)d" fill="none" stroke="#ddd" stroke-width="0.5"/>
+    </pattern>
+    <pattern id="grid" width="%(grid2)d" height="%(grid2)d" patternUnits="userSpaceOnUse">
+      <rect width="%(grid2)d" height="%(grid2)d" fill="url(#smallGrid)"/>
+      <path d="M %(grid2)d 0 L 0 0 0 %(grid2)d" fill="none" stroke="#bbb" stroke-width="1"/>
+    </pattern>
+  </defs>
+  <rect width="100%%" height="100%%" fill="url(#grid)"/>
+  
+'''
+
+_SVG_TITLE = '''  <text x="20" y="25" fill="#232F3E" font-size="14" font-weight="bold">AWS Architecture Diagram</text>
+  <text x="20" y="42" fill="#666" font-size="10">VPCs: %d | Subnets: %d | Relationships: %d</text>
+
+  <!-- Legend -->
+'''
+
+# サブネットの枠は同じスタイルなので、角丸矩形のサブパスを 1 つの <path> にまとめ、ラベルも 1 つの <g> にまとめる
+_SUBNET_BORDER_D = 'M%d,%dh%da5,5 0 0 1 5,5v%da5,5 0 0 1 -5,5h%da5,5 0 0 1 -5,-5v%da5,5 0 0 1 5,-5z'
+_SUBNET_LABEL = '    <text x="%d" y="%d">%s</text>\n'
+_SUBNET_BORDERS = '''  <path d="%s" fill="none" stroke="#7AA116" stroke-width="1.5"/>
+  <g fill="#7AA116" font-size="9">
+%s  </g>
+'''
+
+# 接続線は共通のスタイルを持つ <g> にまとめる
+_SVG_EDGES_OPEN = '\n  <!-- Connections -->\n  <g stroke="#222" stroke-width="1" marker-end="url(#arrowhead)">\n'
+_SVG_EDGES_CLOSE = '  </g>\n'
+_SVG_TAIL = '\n</svg>'
+
+# リソースの配置先（VPC ID, 配置するサブネット ID）
+_Placement = namedtuple('_Placement', 'vpc_id subnet_id')
+
+# 配置したノードの中心座標とサイズ（接続線の端点計算に使う）
+_NodePosition = namedtuple('_NodePosition', 'cx cy w h')
+
+
+def _append_flat(parts, fragments):
+    """
+    断片を順に parts に追加する（各断片は末尾に自前の改行を持つので区切りは入れない）
+    
+    fragments の要素は文字列、または下位レイアウトが返した断片のリスト。
+    文字列の連結は generate() で最後に 1 回だけ行う。
+    """
+    for fragment in fragments:
+        if isinstance(fragment, str):
+            parts.append(fragment)
+        else:
+            parts.extend(fragment)
+    return parts
+
+
 class SVGGenerator:
     """SVG 形式のアーキテクチャ図を生成するクラス"""
     
@@ -73,12 +186,50 @@ class SVGGenerator:
         'Default': {'bg': '#232F3E', 'paths': ['M4,4 L20,4 L20,20 L4,20 Z', 'M8,8 L16,8 L16,16 L8,16 Z']},
     }
     
+    # サブネットに配置するリソース: (reader の属性名, アイコン種別, サブネットに置けない場合に VPC 直下に置くか)
+    # アイコン種別が None の Load Balancer は LoadBalancerType で ALB/NLB を決める。
+    # NAT Gateway は VPC 直下の並び順（IGW の後）を保つため _place_resources で個別に処理する
+    _SUBNET_PLACEMENT = (
+        ('ec2_instances', 'EC2', True),
+        ('lambda_functions', 'Lambda', False),
+        ('eks_clusters', 'EKS', False),
+        ('load_balancers', None, False),
+        ('rds_instances', 'RDS', True),
+    )
+    
+    # VPC 外リソース: (アイコン種別, reader の属性名, まとめて 1 ノードにする場合のノード ID)
+    # まとめるものは件数だけを表示する。Lambda は VPC 内に配置したものを除くため _get_external_resources で個別に処理する
+    _EXTERNAL_RESOURCES = (
+        ('S3', 's3_buckets', '__s3__'),
+        ('TargetGroup', 'target_groups', None),
+        ('DynamoDB', 'dynamodb_tables', None),
+        ('SNS', 'sns_topics', None),
+        ('SQS', 'sqs_queues', None),
+        ('CloudFront', 'cloudfront_distributions', None),
+        ('APIGateway', 'api_gateways', None),
+        ('EventBridge', 'cloudwatch_event_rules', None),
+        ('IAM', 'iam_roles', '__iam__'),
+        ('EFS', 'efs_filesystems', '__efs__'),
+        ('ECS', 'ecs_clusters', None),
+    )
+    
+    # 凡例: タイトル部分の幅と各項目の間隔
+    LEGEND_TITLE_WIDTH = 50
+    LEGEND_ITEM_SPACING = 100
+    
+    # アイコンサイズ -> ラベル各行の開始タグ（_wrap_label の最大 5 行分）
+    _LABEL_PREFIX_CACHE = {}
+    
     # グリッド設定
     GRID_SIZE = 20  # 小格子サイズ
     ICON_SIZE = 40  # アイコンサイズ（2x2 小格子）
     ICON_SPACING = 120  # 横方向アイコン間隔（アイコン40px + 間隔80px = 120px）
     ROW_SPACING = 120  # 縦方向行間隔（アイコン40px + 間隔80px = 120px）
     
+    # ビューポート判定でアイコンに足す余白（ラベルはアイコンの左右と下にはみ出す）
+    LABEL_MARGIN_X = 40
+    LABEL_MARGIN_Y = 70
+    
     # 凡例用サービス名マッピング
     SERVICE_DISPLAY_NAMES = {
         'EC2': 'Amazon EC2',
@@ -106,13 +257,27 @@ class SVGGenerator:
         'IAM': 'AWS IAM',
     }
     
+    @classmethod
+    def _compile_icons(cls):
+        """DEFAULT_ICONS のパスをアイコンごとに 1 つの <path> 要素にしておく（クラス読み込み時に 1 回）"""
+        for icon_def in cls.DEFAULT_ICONS.values():
+            d = ' '.join(icon_def['paths'])
+            icon_def['paths_svg'] = _ICON_PATH % d
+    
     def __init__(self, reader, icons_dir=None):
         self.reader = reader
         self.node_positions = {}
         self.relationships_map = defaultdict(list)
-        self.reverse_relationships = defaultdict(list)
+        self.rel_count = 0  # relationships_map の関係の総数（_build_relationships で設定）
+        self.neighbors = defaultdict(set)  # res_id -> 関係のある（どちら向きでも）res_id の集合
         self.vpc_resource_ids = set()
         self.external_resource_ids = set()
+        self.vpc_lambda_names = set()  # サブネットに配置した Lambda（_place_resources で記録）
+        self.subnet_border_paths = []  # サブネット枠の <path> サブパス（_add_subnet_border で記録）
+        self.subnet_labels = []
+        self.viewport = None  # (x0, y0, x1, y1)。指定時は範囲外のアイコン・接続線を出力しない
+        self._name_cache = {}  # (コレクション名, res_id) -> 表示名（generate ごとに作り直す）
+        self._label_svg_cache = {}  # (ラベル, アイコンサイズ) -> ラベルの SVG（generate を繰り返しても使い回す）
         
         # アイコンディレクトリを設定
         if icons_dir:
@@ -125,6 +290,12 @@ class SVGGenerator:
         # 読み込んだアイコンをキャッシュ
         self.icon_cache = {}
         
+        # <defs> に出力するアイコンの <symbol>: (アイコン種別, サイズ) -> symbol id
+        self.icon_symbol_ids = {}
+        self.icon_symbols = []
+        # (アイコン種別, サイズ) -> ノード 1 つ分の % テンプレート（_ICON_USE_TEMPLATE の symbol_id, size を埋めたもの）
+        self.icon_use_templates = {}
+        
         # アイコンディレクトリの存在確認
         if os.path.exists(self.icons_dir):
             print(f"  Using AWS icons from: {self.icons_dir}")
@@ -154,6 +325,19 @@ class SVGGenerator:
         
         return None
     
+    def _prefetch_icons(self, icon_types, max_workers=4):
+        """
+        使用するアイコンの検索・読み込みを並列に行い icon_cache に入れる
+        
+        アイコン種別ごとに os.walk とファイル読み込みを行うため、I/O 待ちを重ねられる。
+        レイアウト自体は座標が前の VPC の高さに依存し、<symbol> の出力順も保つ必要があるので直列のまま。
+        """
+        pending = [t for t in icon_types if t not in self.icon_cache]
+        if len(pending) < 2 or not os.path.isdir(self.icons_dir):
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            list(executor.map(self._load_svg_icon, pending))
+    
     def _load_svg_icon(self, icon_type):
         """SVG アイコンを読み込み"""
         if icon_type in self.icon_cache:
@@ -174,22 +358,29 @@ class SVGGenerator:
         self.icon_cache[icon_type] = ('default', default, None)
         return self.icon_cache[icon_type]
         
-    def _get_property(self, data, *keys):
+    @staticmethod
+    def _get_property(data, key):
+        """最上位、次に Properties からキー 1 つを取り出す（呼び出しは常に 1 キーなので可変長引数にしない）"""
         if not data:
             return None
-        for key in keys:
-            if key in data:
-                return data[key]
-        props = data.get('Properties', {})
+        if key in data:
+            return data[key]
+        props = data.get('Properties')
         if props:
-            for key in keys:
-                if key in props:
-                    return props[key]
+            return props.get(key)
         return None
     
-    def _get_name(self, res_id, res_data):
+    def _get_name(self, kind, res_id, res_data):
+        """表示名を取得（kind は reader のコレクション名。同じ ID の別種リソースと混ざらないようキーに含める）"""
         if not res_data:
             return res_id
+        key = (kind, res_id)
+        name = self._name_cache.get(key)
+        if name is None:
+            name = self._name_cache[key] = self._read_name(res_id, res_data)
+        return name
+    
+    def _read_name(self, res_id, res_data):
         name = self._get_property(res_data, 'Name')
         if name:
             return name
@@ -207,58 +398,79 @@ class SVGGenerator:
         for rel in self.reader.relationships:
             if len(rel) >= 3:
                 source, target, rel_type = rel[0], rel[1], rel[2]
-                if rel_type not in ['belongs_to', 'in_vpc', 'in_subnet']:
+                if rel_type not in _STRUCTURAL_REL_TYPES:
                     self.relationships_map[source].append((target, rel_type))
-                    self.reverse_relationships[target].append((source, rel_type))
+                    self.neighbors[source].add(target)
+                    self.neighbors[target].add(source)
         
-        total = sum(len(v) for v in self.relationships_map.values())
-        print(f"  Built {total} relationships")
+        # ヘッダーの件数表示にも使うので、ここで 1 回だけ数える
+        self.rel_count = sum(len(v) for v in self.relationships_map.values())
+        print(f"  Built {self.rel_count} relationships")
     
     def _get_connected_external_resources(self, vpc_res_id, external_resources):
-        connected = []
-        for ext_type, ext_id, ext_name in external_resources:
-            is_connected = False
-            for target, _ in self.relationships_map.get(vpc_res_id, []):
-                if target == ext_id:
-                    is_connected = True
-                    break
-            if not is_connected:
-                for source, _ in self.reverse_relationships.get(vpc_res_id, []):
-                    if source == ext_id:
-                        is_connected = True
-                        break
-            if is_connected:
-                connected.append((ext_type, ext_id, ext_name))
-        return connected
+        neighbors = self.neighbors.get(vpc_res_id)
+        if not neighbors:
+            return []
+        return [ext for ext in external_resources if ext[1] in neighbors]
     
     def _are_external_resources_related(self, ext_id1, ext_id2):
         """2つの外部リソースが関連しているか確認"""
-        for target, _ in self.relationships_map.get(ext_id1, []):
-            if target == ext_id2:
-                return True
-        for source, _ in self.reverse_relationships.get(ext_id1, []):
-            if source == ext_id2:
-                return True
-        return False
+        return ext_id2 in self.neighbors.get(ext_id1, ())
+    
+    def _outside_viewport(self, x0, y0, x1, y1):
+        """矩形 (x0, y0)-(x1, y1) がビューポートと重ならないか"""
+        vx0, vy0, vx1, vy1 = self.viewport
+        return x1 < vx0 or x0 > vx1 or y1 < vy0 or y0 > vy1
     
     def _create_icon_svg(self, icon_type, x, y, res_id, label='', size=None):
         if size is None:
             size = self.ICON_SIZE
         
-        self.node_positions[res_id] = (x + size/2, y + size/2, size, size)
+        half = size // 2
+        # 接続線の端点に使うため、範囲外でも位置は記録する
+        self.node_positions[res_id] = _NodePosition(x + half, y + half, size, size)
         
-        # ラベルを複数行に分割（長い名前に対応）
-        label_lines = self._wrap_label(str(label) if label else '', max_chars=20)
+        if self.viewport is not None and self._outside_viewport(
+                x - self.LABEL_MARGIN_X, y, x + size + self.LABEL_MARGIN_X, y + size + self.LABEL_MARGIN_Y):
+            return ''
+        
+        # ラベルを複数行に分割（長い名前に対応）。ラベルとサイズだけで決まるので描画結果を再利用する
+        label = str(label) if label else ''
+        label_key = (label, size)
+        label_svg = self._label_svg_cache.get(label_key)
+        if label_svg is None:
+            # 折り返し位置は元の文字数で決め、エスケープは行ごとに行う
+            label_lines = [escape(line) for line in self._wrap_label(label, max_chars=20)]
+            label_svg = self._label_svg_cache[label_key] = self._create_label_svg(label_lines, size)
+        
+        template = self.icon_use_templates.get((icon_type, size))
+        if template is None:
+            template = self.icon_use_templates[(icon_type, size)] = _ICON_USE_TEMPLATE.format(
+                symbol_id=self._get_icon_symbol(icon_type, size), size=size
+            )
+        return template % (res_id, x, y, label_svg)
+    
+    def _get_icon_symbol(self, icon_type, size):
+        """アイコンの <symbol> を（初回のみ）作成し、その id を返す"""
+        key = (icon_type, size)
+        symbol_id = self.icon_symbol_ids.get(key)
+        if symbol_id is not None:
+            return symbol_id
         
         # アイコンを読み込み
         icon_source, icon_data, icon_path = self._load_svg_icon(icon_type)
         
         if icon_source == 'file':
             # 公式 SVG ファイルを使用
-            return self._create_icon_from_svg_file(icon_data, x, y, res_id, label_lines, size)
+            body = self._create_icon_from_svg_file(icon_data, size)
         else:
             # デフォルトアイコンを使用
-            return self._create_icon_from_default(icon_data, x, y, res_id, label_lines, size)
+            body = self._create_icon_from_default(icon_data, size)
+        
+        symbol_id = f'icon-{icon_type}-{size}'
+        self.icon_symbol_ids[key] = symbol_id
+        self.icon_symbols.append(_SYMBOL_TEMPLATE.format(symbol_id=symbol_id, size=size, body=body))
+        return symbol_id
     
     def _wrap_label(self, label, max_chars=20):
         """ラベルを複数行に分割"""
@@ -306,17 +518,19 @@ class SVGGenerator:
         if not label_lines:
             return ''
         
-        label_svg = ''
-        line_height = 11
-        start_y = size + 12
+        prefixes = self._LABEL_PREFIX_CACHE.get(size)
+        if prefixes is None:
+            line_height = 11
+            start_y = size + 12
+            half = size // 2
+            prefixes = self._LABEL_PREFIX_CACHE[size] = [
+                _LABEL_PREFIX.format(half, start_y + i * line_height) for i in range(5)
+            ]
         
-        for i, line in enumerate(label_lines):
-            label_svg += f'      <text x="{size/2}" y="{start_y + i * line_height}" text-anchor="middle" fill="#333" font-size="9">{line}</text>\n'
-        
-        return label_svg
+        return ''.join(prefix + line + '</text>\n' for prefix, line in zip(prefixes, label_lines))
     
-    def _create_icon_from_svg_file(self, svg_content, x, y, res_id, label_lines, size):
-        """公式 SVG ファイルからアイコンを作成"""
+    def _create_icon_from_svg_file(self, svg_content, size):
+        """公式 SVG ファイルからアイコンの図形を作成"""
         # SVG の viewBox を取得
         viewbox_match = re.search(r'viewBox="([^"]+)"', svg_content)
         if viewbox_match:
@@ -339,52 +553,46 @@ class SVGGenerator:
         # スケール計算
         scale = size / max(vb_width, vb_height)
         
-        label_svg = self._create_label_svg(label_lines, size)
-        
-        return f'''    <g id="{res_id}" transform="translate({x},{y})">
-      <g transform="scale({scale:.4f})">
-{inner_content}
-      </g>
-{label_svg}    </g>
-'''
+        return _FILE_ICON_BODY.format(scale=scale, inner=inner_content)
     
-    def _create_icon_from_default(self, icon_def, x, y, res_id, label_lines, size):
-        """デフォルトアイコンを作成"""
-        bg_color = icon_def['bg']
-        paths = icon_def['paths']
-        scale = size / 24
-        
-        path_elements = ''
-        for p in paths:
-            path_elements += f'        <path d="{p}" fill="none" stroke="white" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>\n'
-        
-        label_svg = self._create_label_svg(label_lines, size)
-        
-        return f'''    <g id="{res_id}" transform="translate({x},{y})">
-      <rect x="0" y="0" width="{size}" height="{size}" rx="4" fill="{bg_color}"/>
-      <g transform="scale({scale:.3f})">
-{path_elements}      </g>
-{label_svg}    </g>
-'''
+    def _create_icon_from_default(self, icon_def, size):
+        """デフォルトアイコンの図形を作成"""
+        return _DEFAULT_ICON_BODY.format(
+            size=size, bg=icon_def['bg'], scale=size / 24, paths=icon_def['paths_svg']
+        )
     
     def _create_edge_svg(self, source_id, target_id):
-        if source_id not in self.node_positions or target_id not in self.node_positions:
+        src = self.node_positions.get(source_id)
+        dst = self.node_positions.get(target_id)
+        if src is None or dst is None:
             return ''
         
-        src_x, src_y, _, src_h = self.node_positions[source_id]
-        dst_x, dst_y, _, dst_h = self.node_positions[target_id]
+        src_x, src_y, _, src_h = src
+        dst_x, dst_y, _, dst_h = dst
         
         if abs(dst_y - src_y) > abs(dst_x - src_x):
             if dst_y > src_y:
-                src_y += src_h / 2
-                dst_y -= dst_h / 2
+                src_y += src_h // 2
+                dst_y -= dst_h // 2
             else:
-                src_y -= src_h / 2
-                dst_y += dst_h / 2
+                src_y -= src_h // 2
+                dst_y += dst_h // 2
+        
+        if self.viewport is not None and self._outside_viewport(
+                min(src_x, dst_x), min(src_y, dst_y), max(src_x, dst_x), max(src_y, dst_y)):
+            return ''
         
-        return f'    <line x1="{src_x:.0f}" y1="{src_y:.0f}" x2="{dst_x:.0f}" y2="{dst_y:.0f}" stroke="#222" stroke-width="1" marker-end="url(#arrowhead)"/>\n'
+        return _EDGE_TEMPLATE % (src_x, src_y, dst_x, dst_y)
     
-    def generate(self, output_dir, output_name='aws-architecture'):
+    def generate(self, output_dir, output_name='aws-architecture', viewport=None):
+        """
+        SVG を生成してファイルパスを返す
+        
+        viewport に (x0, y0, x1, y1) を指定すると、その範囲と重ならないアイコン・接続線は出力しない
+        （図の大きさと配置は変わらない。一部だけを表示するビューア向け）。
+        """
+        self.viewport = viewport
+        self._reset_render_state()
         print("\n" + "=" * 80)
         print("Generating SVG Architecture Diagram")
         print("=" * 80 + "\n")
@@ -401,18 +609,39 @@ class SVGGenerator:
         
         # 使用されているアイコンタイプを収集
         used_icon_types = self._collect_used_icon_types(vpc_data, external_resources)
+        self._prefetch_icons(used_icon_types)
         
-        content_svg, total_width, total_height = self._layout_all(vpc_data, external_resources)
+        content_parts, total_width, total_height = self._layout_all(vpc_data, external_resources)
         
-        svg_content = self._build_svg_document(content_svg, total_width, total_height, used_icon_types)
+        # 文書全体を 1 つの文字列にはせず、断片のまま順に書き出す
+        svg_parts = self._build_svg_document(content_parts, total_width, total_height, used_icon_types)
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(svg_content)
+        with open(output_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.writelines(svg_parts)
         
         print(f"\n✓ SVG diagram generated: {output_path}")
         print(f"  Size: {total_width} x {total_height}")
         return output_path
     
+    def _reset_render_state(self):
+        """
+        前回の generate で記録した関係・配置・サブネット枠・アイコンシンボル・表示名を破棄
+        
+        同じインスタンスで generate を繰り返したときに、古い座標の要素が混ざらないようにする
+        （表示名は reader の変更を反映するため作り直す。アイコン・ラベルのキャッシュは座標に依存しないので残す）
+        """
+        self._name_cache = {}
+        self.relationships_map = defaultdict(list)
+        self.neighbors = defaultdict(set)
+        self.node_positions = {}
+        self.vpc_resource_ids = set()
+        self.external_resource_ids = set()
+        self.subnet_border_paths = []
+        self.subnet_labels = []
+        self.icon_symbol_ids = {}
+        self.icon_symbols = []
+        self.icon_use_templates = {}
+    
     def _collect_used_icon_types(self, vpc_data, external_resources):
         """使用されているアイコンタイプを収集"""
         used = set()
@@ -457,11 +686,12 @@ class SVGGenerator:
                 subnet_to_vpc[subnet_id] = vpc_id
         
         for vpc_id, vpc_info in reader.vpcs.items():
-            vpc_name = self._get_name(vpc_id, vpc_info)
+            vpc_name = self._get_name('vpcs', vpc_id, vpc_info)
             cidr = self._get_property(vpc_info, 'CidrBlock') or ''
             vpc_data[vpc_id] = {
                 'name': vpc_name,
                 'cidr': cidr,
+                'label': escape(f'{vpc_name[:30]} ({cidr})'),  # 枠に表示する文字列（切り詰め・エスケープ済み）
                 'subnets': {},
                 'vpc_level_resources': [],
             }
@@ -469,82 +699,68 @@ class SVGGenerator:
         for subnet_id, subnet_info in reader.subnets.items():
             vpc_id = subnet_to_vpc.get(subnet_id)
             if vpc_id and vpc_id in vpc_data:
-                subnet_name = self._get_name(subnet_id, subnet_info)
+                subnet_name = self._get_name('subnets', subnet_id, subnet_info)
                 az = self._get_property(subnet_info, 'AvailabilityZone') or ''
+                az = az[-2:] if az else ''
                 vpc_data[vpc_id]['subnets'][subnet_id] = {
                     'name': subnet_name,
-                    'az': az[-2:] if az else '',
+                    'az': az,
+                    'label': escape(f'{subnet_name[:12]} ({az})' if az else subnet_name[:12]),
                     'resources': []
                 }
         
         self._place_resources(vpc_data, subnet_to_vpc)
+        
+        # レイアウト時に毎回 list 化しないよう、サブネットの並び（reader の順）を 1 回だけ固定しておく
+        for vpc_info in vpc_data.values():
+            vpc_info['subnets_list'] = tuple(vpc_info['subnets'].items())
         return vpc_data
     
+    def _extract_placement(self, data):
+        """リソースの配置先を 1 回で取り出す（サブネットは SubnetId、VpcConfig.SubnetIds、SubnetIds、Subnets の順）"""
+        vpc_id = self._get_property(data, 'VpcId')
+        subnet_id = self._get_property(data, 'SubnetId')
+        if not subnet_id:
+            vpc_config = self._get_property(data, 'VpcConfig') or {}
+            subnet_ids = (vpc_config.get('SubnetIds')
+                          or self._get_property(data, 'SubnetIds')
+                          or self._get_property(data, 'Subnets'))
+            subnet_id = subnet_ids[0] if subnet_ids else None
+        return _Placement(vpc_id, subnet_id)
+    
     def _place_resources(self, vpc_data, subnet_to_vpc):
         reader = self.reader
-        
-        for ec2_id, data in reader.ec2_instances.items():
-            subnet_id = self._get_property(data, 'SubnetId')
-            name = self._get_name(ec2_id, data)
-            placed = self._add_to_subnet(vpc_data, subnet_to_vpc, subnet_id, ('EC2', ec2_id, name))
-            if not placed:
-                vpc_id = self._get_property(data, 'VpcId')
-                if vpc_id and vpc_id in vpc_data:
-                    vpc_data[vpc_id]['vpc_level_resources'].append(('EC2', ec2_id, name))
-        
-        for func_name, data in reader.lambda_functions.items():
-            vpc_config = self._get_property(data, 'VpcConfig') or {}
-            subnet_ids = vpc_config.get('SubnetIds', [])
-            if not subnet_ids:
-                subnet_ids = self._get_property(data, 'SubnetIds') or []
-            name = self._get_name(func_name, data)
-            if subnet_ids and len(subnet_ids) > 0:
-                self._add_to_subnet(vpc_data, subnet_to_vpc, subnet_ids[0], ('Lambda', func_name, name))
-        
-        for cluster_name, data in reader.eks_clusters.items():
-            subnet_ids = self._get_property(data, 'SubnetIds') or []
-            name = self._get_name(cluster_name, data)
-            if subnet_ids and len(subnet_ids) > 0:
-                self._add_to_subnet(vpc_data, subnet_to_vpc, subnet_ids[0], ('EKS', cluster_name, name))
-        
-        for lb_name, data in reader.load_balancers.items():
-            subnet_ids = self._get_property(data, 'SubnetIds') or self._get_property(data, 'Subnets') or []
-            lb_type = self._get_property(data, 'LoadBalancerType') or 'application'
-            icon = 'NLB' if 'network' in str(lb_type).lower() else 'ALB'
-            name = self._get_name(lb_name, data)
-            if subnet_ids and len(subnet_ids) > 0:
-                self._add_to_subnet(vpc_data, subnet_to_vpc, subnet_ids[0], (icon, lb_name, name))
-        
-        for db_id, data in reader.rds_instances.items():
-            subnet_ids = self._get_property(data, 'SubnetIds') or []
-            vpc_id = self._get_property(data, 'VpcId')
-            name = self._get_name(db_id, data)
-            placed = False
-            if subnet_ids and len(subnet_ids) > 0:
-                placed = self._add_to_subnet(vpc_data, subnet_to_vpc, subnet_ids[0], ('RDS', db_id, name))
-            if not placed and vpc_id and vpc_id in vpc_data:
-                vpc_data[vpc_id]['vpc_level_resources'].append(('RDS', db_id, name))
+        self.vpc_lambda_names = set()
+        
+        for attr, icon, vpc_fallback in self._SUBNET_PLACEMENT:
+            for res_id, data in getattr(reader, attr).items():
+                placement = self._extract_placement(data)
+                if icon is None:
+                    lb_type = self._get_property(data, 'LoadBalancerType') or 'application'
+                    res_icon = 'NLB' if 'network' in str(lb_type).lower() else 'ALB'
+                else:
+                    res_icon = icon
+                name = self._get_name(attr, res_id, data)
+                
+                placed = self._add_to_subnet(vpc_data, subnet_to_vpc, placement.subnet_id, (res_icon, res_id, name))
+                if placed:
+                    if res_icon == 'Lambda':
+                        self.vpc_lambda_names.add(res_id)
+                elif vpc_fallback and placement.vpc_id in vpc_data:
+                    vpc_data[placement.vpc_id]['vpc_level_resources'].append((res_icon, res_id, name))
         
         for cache_id, data in reader.elasticache_clusters.items():
             vpc_id = self._get_property(data, 'VpcId')
-            name = self._get_name(cache_id, data)
+            name = self._get_name('elasticache_clusters', cache_id, data)
             if vpc_id and vpc_id in vpc_data:
                 vpc_data[vpc_id]['vpc_level_resources'].append(('ElastiCache', cache_id, name))
         
-        vpc_endpoints_by_vpc = defaultdict(int)
-        for ep_id, data in reader.vpc_endpoints.items():
-            vpc_id = self._get_property(data, 'VpcId')
-            if vpc_id:
-                vpc_endpoints_by_vpc[vpc_id] += 1
+        vpc_endpoints_by_vpc = self._count_by_vpc(reader.vpc_endpoints)
         for vpc_id, count in vpc_endpoints_by_vpc.items():
             if vpc_id in vpc_data:
                 vpc_data[vpc_id]['vpc_level_resources'].append(('VPCEndpoint', f'__vpce_{vpc_id}__', f'VPCE ({count})'))
         
-        sg_by_vpc = defaultdict(int)
-        for sg_id, data in reader.security_groups.items():
-            vpc_id = self._get_property(data, 'VpcId')
-            if vpc_id:
-                sg_by_vpc[vpc_id] += 1
+        sg_by_vpc = self._count_by_vpc(reader.security_groups)
         for vpc_id, count in sg_by_vpc.items():
             if vpc_id in vpc_data:
                 vpc_data[vpc_id]['vpc_level_resources'].append(('SecurityGroup', f'__sg_{vpc_id}__', f'SG ({count})'))
@@ -554,18 +770,23 @@ class SVGGenerator:
             for att in attachments:
                 vpc_id = att.get('VpcId') if isinstance(att, dict) else None
                 if vpc_id and vpc_id in vpc_data:
-                    name = self._get_name(igw_id, data)
+                    name = self._get_name('internet_gateways', igw_id, data)
                     vpc_data[vpc_id]['vpc_level_resources'].append(('InternetGateway', igw_id, name))
         
         for nat_id, data in reader.nat_gateways.items():
             vpc_id = self._get_property(data, 'VpcId')
             subnet_id = self._get_property(data, 'SubnetId')
-            name = self._get_name(nat_id, data)
+            name = self._get_name('nat_gateways', nat_id, data)
             if subnet_id:
                 self._add_to_subnet(vpc_data, subnet_to_vpc, subnet_id, ('NATGateway', nat_id, name))
             elif vpc_id and vpc_id in vpc_data:
                 vpc_data[vpc_id]['vpc_level_resources'].append(('NATGateway', nat_id, name))
     
+    def _count_by_vpc(self, resources):
+        """VPC ID ごとのリソース数（VPC ID を持たないものは除く）"""
+        vpc_ids = (self._get_property(data, 'VpcId') for data in resources.values())
+        return Counter(vpc_id for vpc_id in vpc_ids if vpc_id)
+    
     def _add_to_subnet(self, vpc_data, subnet_to_vpc, subnet_id, resource):
         if not subnet_id:
             return False
@@ -580,49 +801,20 @@ class SVGGenerator:
         reader = self.reader
         external = []
         
-        if reader.s3_buckets:
-            external.append(('S3', '__s3__', f'S3 ({len(reader.s3_buckets)})'))
-        
-        for name, data in reader.target_groups.items():
-            external.append(('TargetGroup', name, self._get_name(name, data)))
-        
-        for name, data in reader.dynamodb_tables.items():
-            external.append(('DynamoDB', name, self._get_name(name, data)))
-        
-        for name, data in reader.sns_topics.items():
-            external.append(('SNS', name, self._get_name(name, data)))
-        
-        for name, data in reader.sqs_queues.items():
-            external.append(('SQS', name, self._get_name(name, data)))
-        
-        for name, data in reader.cloudfront_distributions.items():
-            external.append(('CloudFront', name, self._get_name(name, data)))
-        
-        for name, data in reader.api_gateways.items():
-            external.append(('APIGateway', name, self._get_name(name, data)))
-        
-        for name, data in reader.cloudwatch_event_rules.items():
-            external.append(('EventBridge', name, self._get_name(name, data)))
-        
-        if reader.iam_roles:
-            external.append(('IAM', '__iam__', f'IAM ({len(reader.iam_roles)})'))
-        
-        if reader.efs_filesystems:
-            external.append(('EFS', '__efs__', f'EFS ({len(reader.efs_filesystems)})'))
-        
-        for name, data in reader.ecs_clusters.items():
-            external.append(('ECS', name, self._get_name(name, data)))
-        
-        vpc_lambda_names = set()
-        for func_name, data in reader.lambda_functions.items():
-            vpc_config = self._get_property(data, 'VpcConfig') or {}
-            subnet_ids = vpc_config.get('SubnetIds', [])
-            if subnet_ids and len(subnet_ids) > 0:
-                vpc_lambda_names.add(func_name)
+        for icon_type, attr, summary_id in self._EXTERNAL_RESOURCES:
+            resources = getattr(reader, attr)
+            if summary_id:
+                if resources:
+                    external.append((icon_type, summary_id, f'{icon_type} ({len(resources)})'))
+            else:
+                for name, data in resources.items():
+                    external.append((icon_type, name, self._get_name(attr, name, data)))
         
+        # VPC 内 Lambda は _organize_by_vpc でサブネットに配置済み
+        vpc_lambda_names = self.vpc_lambda_names
         for func_name, data in reader.lambda_functions.items():
             if func_name not in vpc_lambda_names:
-                external.append(('Lambda', func_name, self._get_name(func_name, data)))
+                external.append(('Lambda', func_name, self._get_name('lambda_functions', func_name, data)))
         
         return external
     
@@ -641,7 +833,7 @@ class SVGGenerator:
             max_width = max(max_width, vpc_width + 40)
         
         # VPC 外リソース（左: 無関連、右: 関連あり）
-        orphan_external, related_external = self._split_external_resources(external_resources)
+        orphan_external, related_external = self._split_external_resources(vpc_data, external_resources)
         
         if orphan_external or related_external:
             ext_svg, ext_width, ext_height = self._layout_split_external(
@@ -651,27 +843,25 @@ class SVGGenerator:
             current_y += ext_height + 20
             max_width = max(max_width, ext_width + 40)
         
-        return '\n'.join(svg_parts), max_width, current_y
+        return _append_flat([], svg_parts), max_width, current_y
     
-    def _split_external_resources(self, external_resources):
+    def _split_external_resources(self, vpc_data, external_resources):
         """外部リソースを無関連と関連ありに分割"""
-        # VPC 内リソースとの関連をチェック
+        ext_ids = {ext_id for _, ext_id, _ in external_resources}
+        
+        # VPC 内（サブネット内）リソースとの関連をチェック
         used_by_vpc = set()
-        for vpc_id, vpc_info in self._organize_by_vpc().items():
+        for vpc_info in vpc_data.values():
             for subnet_info in vpc_info.get('subnets', {}).values():
                 for icon_type, res_id, name in subnet_info.get('resources', []):
-                    connected = self._get_connected_external_resources(res_id, external_resources)
-                    for _, ext_id, _ in connected:
-                        used_by_vpc.add(ext_id)
+                    used_by_vpc |= self.neighbors.get(res_id, set()) & ext_ids
         
-        # 外部リソース同士の関連をチェック
+        # 外部リソース同士の関連をチェック（他の外部リソースと関係を持つもの）
+        # （隣接リソースだけを調べ、外部リソース数に対して線形に抑える）
         related_pairs = set()
-        ext_ids = [ext_id for _, ext_id, _ in external_resources]
-        for i, ext_id1 in enumerate(ext_ids):
-            for ext_id2 in ext_ids[i+1:]:
-                if self._are_external_resources_related(ext_id1, ext_id2):
-                    related_pairs.add(ext_id1)
-                    related_pairs.add(ext_id2)
+        for ext_id in ext_ids:
+            if any(n != ext_id and n in ext_ids for n in self.neighbors.get(ext_id, ())):
+                related_pairs.add(ext_id)
         
         orphan = []
         related = []
@@ -697,6 +887,10 @@ class SVGGenerator:
         # タイトル
         svg_parts.append(f'    <text x="{start_x + 10}" y="{start_y + 15}" fill="#666" font-size="11">External Resources</text>\n')
         
+        # アイコンごとのループでは属性参照を省くためローカルに束縛する
+        append = svg_parts.append
+        create_icon = self._create_icon_svg
+        
         content_y = start_y + 30
         left_width = 0
         left_height = 0
@@ -708,14 +902,13 @@ class SVGGenerator:
             total = len(orphan_external)
             # 3:2 比率を目指す
             cols = max(1, int(math.sqrt(total * 1.5)))
-            rows = math.ceil(total / cols)
+            rows = -(-total // cols)
             
-            for i, (icon_type, res_id, name) in enumerate(orphan_external):
-                col = i % cols
-                row = i // cols
-                x = start_x + 10 + col * spacing
-                y = content_y + row * row_spacing
-                svg_parts.append(self._create_icon_svg(icon_type, x, y, res_id, name))
+            # 列・行の座標は先に表にしておき、product で行優先の (y, x) を順に取り出す
+            col_x = [start_x + 10 + col * spacing for col in range(cols)]
+            row_y = [content_y + row * row_spacing for row in range(rows)]
+            for (y, x), (icon_type, res_id, name) in zip(product(row_y, col_x), orphan_external):
+                append(create_icon(icon_type, x, y, res_id, name))
             
             left_width = cols * spacing + 20
             left_height = rows * row_spacing
@@ -732,10 +925,10 @@ class SVGGenerator:
             
             for group in groups:
                 # 各グループを縦に配置
-                for i, (icon_type, res_id, name) in enumerate(group):
-                    x = group_x
-                    y = content_y + i * row_spacing
-                    svg_parts.append(self._create_icon_svg(icon_type, x, y, res_id, name))
+                svg_parts.extend(
+                    create_icon(icon_type, group_x, content_y + i * row_spacing, res_id, name)
+                    for i, (icon_type, res_id, name) in enumerate(group)
+                )
                 
                 group_height = len(group) * row_spacing
                 max_group_height = max(max_group_height, group_height)
@@ -755,7 +948,7 @@ class SVGGenerator:
         # 枠（背景なし）
         border = f'    <rect x="{start_x}" y="{start_y}" width="{total_width}" height="{total_height}" fill="none" stroke="#ccc" stroke-width="1" stroke-dasharray="5,3" rx="8"/>\n'
         
-        return border + '\n'.join(svg_parts), total_width, total_height
+        return _append_flat([border], svg_parts), total_width, total_height
     
     def _find_related_groups(self, resources):
         """関連するリソースをグループ化"""
@@ -764,21 +957,21 @@ class SVGGenerator:
         
         groups = []
         used = set()
+        position = {res[1]: i for i, res in enumerate(resources)}
         
-        for icon_type, res_id, name in resources:
+        for res in resources:
+            res_id = res[1]
             if res_id in used:
                 continue
             
-            group = [(icon_type, res_id, name)]
+            group = [res]
             used.add(res_id)
             
-            # 関連するリソースを探す
-            for icon_type2, res_id2, name2 in resources:
-                if res_id2 in used:
-                    continue
-                if self._are_external_resources_related(res_id, res_id2):
-                    group.append((icon_type2, res_id2, name2))
-                    used.add(res_id2)
+            # 関連するリソースを探す（リスト内の順序を保つ）
+            related = sorted(position[n] for n in self.neighbors.get(res_id, ()) if n in position and n not in used)
+            for i in related:
+                group.append(resources[i])
+                used.add(resources[i][1])
             
             groups.append(group)
         
@@ -787,9 +980,7 @@ class SVGGenerator:
     def _layout_vpc_with_external(self, vpc_id, vpc_info, external_resources, start_x, start_y):
         svg_parts = []
         
-        vpc_name = vpc_info['name']
-        cidr = vpc_info['cidr']
-        subnets = vpc_info['subnets']
+        vpc_label = vpc_info['label']
         vpc_level_resources = vpc_info.get('vpc_level_resources', [])
         
         spacing = self.ICON_SPACING
@@ -798,15 +989,13 @@ class SVGGenerator:
         current_y = start_y + 28
         max_content_width = 150
         
-        subnet_items = list(subnets.items())
-        if subnet_items:
-            for subnet_id, subnet_info in subnet_items:
-                s_svg, s_width, s_height = self._layout_subnet_aligned(
-                    subnet_id, subnet_info, external_resources, start_x + 15, current_y
-                )
-                svg_parts.append(s_svg)
-                max_content_width = max(max_content_width, s_width + 30)
-                current_y += s_height + 20
+        for subnet_id, subnet_info in vpc_info['subnets_list']:
+            s_svg, s_width, s_height = self._layout_subnet_aligned(
+                subnet_id, subnet_info, external_resources, start_x + 15, current_y
+            )
+            svg_parts.append(s_svg)
+            max_content_width = max(max_content_width, s_width + 30)
+            current_y += s_height + 20
         
         if vpc_level_resources:
             res_svg, res_width, res_height = self._layout_resource_row(
@@ -821,16 +1010,20 @@ class SVGGenerator:
         
         vpc_border = f'''    <rect x="{start_x}" y="{start_y}" width="{vpc_width}" height="{vpc_height}" 
           fill="none" stroke="#8C4FFF" stroke-width="2" rx="8"/>
-    <text x="{start_x + 10}" y="{start_y + 18}" fill="#8C4FFF" font-size="11" font-weight="bold">{vpc_name[:30]} ({cidr})</text>
+    <text x="{start_x + 10}" y="{start_y + 18}" fill="#8C4FFF" font-size="11" font-weight="bold">{vpc_label}</text>
 '''
         
-        return vpc_border + '\n'.join(svg_parts), vpc_width, vpc_height
+        return _append_flat([vpc_border], svg_parts), vpc_width, vpc_height
+    
+    def _add_subnet_border(self, label, x, y, width, height):
+        """サブネットの枠（角丸 5）とラベルを記録する。出力は _build_svg_document でまとめて行う"""
+        self.subnet_border_paths.append(_SUBNET_BORDER_D % (x + 5, y, width - 10, height - 10, 10 - width, 10 - height))
+        self.subnet_labels.append(_SUBNET_LABEL % (x + 8, y + 14, label))
     
     def _layout_subnet_aligned(self, subnet_id, subnet_info, external_resources, start_x, start_y):
         svg_parts = []
         
-        subnet_name = subnet_info['name']
-        az = subnet_info['az']
+        subnet_label = subnet_info['label']
         resources = subnet_info.get('resources', [])
         
         spacing = self.ICON_SPACING
@@ -839,14 +1032,8 @@ class SVGGenerator:
         if not resources:
             subnet_width = 80
             subnet_height = 60
-            label = f"{subnet_name[:12]}"
-            if az:
-                label += f" ({az})"
-            border = f'''    <rect x="{start_x}" y="{start_y}" width="{subnet_width}" height="{subnet_height}" 
-          fill="none" stroke="#7AA116" stroke-width="1.5" rx="5"/>
-    <text x="{start_x + 8}" y="{start_y + 14}" fill="#7AA116" font-size="9">{label}</text>
-'''
-            return border, subnet_width, subnet_height
+            self._add_subnet_border(subnet_label, start_x, start_y, subnet_width, subnet_height)
+            return [], subnet_width, subnet_height
         
         # 各 VPC 内リソースの関連外部リソースを取得
         res_with_external = []
@@ -854,65 +1041,69 @@ class SVGGenerator:
             connected_ext = self._get_connected_external_resources(res_id, external_resources)
             res_with_external.append((icon_type, res_id, name, connected_ext))
         
-        res_with_external.sort(key=lambda x: len(x[3]), reverse=True)
-        
-        # 列位置を計算
-        col_positions = []
-        current_col = 0
-        for icon_type, res_id, name, connected_ext in res_with_external:
-            col_positions.append(current_col)
-            ext_count = len(connected_ext)
-            cols_needed = max(1, min(3, ext_count))
-            current_col += cols_needed
-        
-        total_cols = current_col
+        has_external = any(r[3] for r in res_with_external)
+        if has_external:
+            res_with_external.sort(key=lambda x: len(x[3]), reverse=True)
+            
+            # 列位置を計算
+            col_positions = []
+            current_col = 0
+            for icon_type, res_id, name, connected_ext in res_with_external:
+                col_positions.append(current_col)
+                ext_count = len(connected_ext)
+                cols_needed = max(1, min(3, ext_count))
+                current_col += cols_needed
+            
+            total_cols = current_col
+        else:
+            # 関連する外部リソースがなければ並べ替えは不要で、1 リソース 1 列になる
+            col_positions = range(len(res_with_external))
+            total_cols = len(res_with_external)
         
         # VPC 内リソースを配置
         content_y = start_y + 24
-        for i, (icon_type, res_id, name, connected_ext) in enumerate(res_with_external):
-            col = col_positions[i]
-            x = start_x + 10 + col * spacing
-            svg_parts.append(self._create_icon_svg(icon_type, x, content_y, res_id, name))
+        create_icon = self._create_icon_svg
+        svg_parts.extend(
+            create_icon(icon_type, start_x + 10 + col * spacing, content_y, res_id, name)
+            for col, (icon_type, res_id, name, connected_ext) in zip(col_positions, res_with_external)
+        )
         
         row_spacing = self.ROW_SPACING
         subnet_internal_height = icon_size + 20 + 28
         subnet_width = max(total_cols * spacing + 25, 80)
         
-        label = f"{subnet_name[:12]}"
-        if az:
-            label += f" ({az})"
-        
-        border = f'''    <rect x="{start_x}" y="{start_y}" width="{subnet_width}" height="{subnet_internal_height}" 
-          fill="none" stroke="#7AA116" stroke-width="1.5" rx="5"/>
-    <text x="{start_x + 8}" y="{start_y + 14}" fill="#7AA116" font-size="9">{label}</text>
-'''
-        svg_parts.insert(0, border)
+        self._add_subnet_border(subnet_label, start_x, start_y, subnet_width, subnet_internal_height)
         
         # 外部リソースを配置
         ext_y = start_y + subnet_internal_height + 10
         max_ext_height = 0
+        if not has_external:
+            return _append_flat([], svg_parts), subnet_width, subnet_internal_height + 10
+        
+        # 列・行の座標は先に表にしておく（外部リソースは 1 リソースあたり最大 3 列）
+        max_ext_rows = max(-(-len(r[3]) // 3) for r in res_with_external)
+        col_x = [start_x + 10 + col * spacing for col in range(total_cols)]
+        row_y = [ext_y + row * row_spacing for row in range(max_ext_rows)]
         
+        append = svg_parts.append
         for i, (icon_type, res_id, name, connected_ext) in enumerate(res_with_external):
             if not connected_ext:
                 continue
             
             col_start = col_positions[i]
             cols = min(3, len(connected_ext))
-            rows = math.ceil(len(connected_ext) / cols)
+            rows = -(-len(connected_ext) // cols)
             
-            for j, (ext_type, ext_id, ext_name) in enumerate(connected_ext):
-                ext_col = j % cols
-                ext_row = j // cols
-                x = start_x + 10 + (col_start + ext_col) * spacing
-                y = ext_y + ext_row * row_spacing
-                svg_parts.append(self._create_icon_svg(ext_type, x, y, ext_id, ext_name))
+            ext_positions = product(row_y[:rows], col_x[col_start:col_start + cols])
+            for (y, x), (ext_type, ext_id, ext_name) in zip(ext_positions, connected_ext):
+                append(create_icon(ext_type, x, y, ext_id, ext_name))
             
             ext_height = rows * row_spacing
             max_ext_height = max(max_ext_height, ext_height)
         
         total_height = subnet_internal_height + 10 + max_ext_height
         
-        return '\n'.join(svg_parts), subnet_width, total_height
+        return _append_flat([], svg_parts), subnet_width, total_height
     
     def _layout_resource_row(self, resources, start_x, start_y, max_cols):
         svg_parts = []
@@ -921,35 +1112,41 @@ class SVGGenerator:
         row_spacing = self.ROW_SPACING
         
         if not resources:
-            return '', 0, 0
+            return [], 0, 0
         
         cols = min(max_cols, len(resources))
-        rows = math.ceil(len(resources) / cols)
+        rows = -(-len(resources) // cols)
         
-        for i, (icon_type, res_id, name) in enumerate(resources):
-            col = i % cols
-            row = i // cols
-            x = start_x + col * spacing
-            y = start_y + row * row_spacing
-            svg_parts.append(self._create_icon_svg(icon_type, x, y, res_id, name))
+        col_x = [start_x + col * spacing for col in range(cols)]
+        row_y = [start_y + row * row_spacing for row in range(rows)]
+        append = svg_parts.append
+        create_icon = self._create_icon_svg
+        for (y, x), (icon_type, res_id, name) in zip(product(row_y, col_x), resources):
+            append(create_icon(icon_type, x, y, res_id, name))
         
         width = cols * spacing
         height = rows * row_spacing + 5
         
-        return '\n'.join(svg_parts), width, height
+        return _append_flat([], svg_parts), width, height
+    
+    def _legend_width(self, used_icon_types):
+        """凡例の幅（_create_legend で描画せずに求める）"""
+        count = sum(1 for icon_type in used_icon_types if icon_type in self.SERVICE_DISPLAY_NAMES)
+        return self.LEGEND_TITLE_WIDTH + count * self.LEGEND_ITEM_SPACING
     
     def _create_legend(self, used_icon_types, start_x, start_y):
-        """凡例を作成"""
+        """凡例を作成（断片のリストを返す。各断片は末尾に改行を含み、そのまま連結して書き出す）"""
         svg_parts = []
         
         icon_size = 24  # 凡例用の小さいアイコン
-        item_spacing = 100  # 各凡例アイテムの間隔
+        item_spacing = self.LEGEND_ITEM_SPACING
         
         # 凡例タイトル
         svg_parts.append(f'    <text x="{start_x}" y="{start_y}" fill="#232F3E" font-size="10" font-weight="bold">Legend:</text>\n')
         
-        x = start_x + 50
+        x = start_x + self.LEGEND_TITLE_WIDTH
         y = start_y - 8
+        append = svg_parts.append
         
         for icon_type in used_icon_types:
             if icon_type not in self.SERVICE_DISPLAY_NAMES:
@@ -957,94 +1154,52 @@ class SVGGenerator:
             
             display_name = self.SERVICE_DISPLAY_NAMES[icon_type]
             
-            # アイコンを読み込み
-            icon_source, icon_data, icon_path = self._load_svg_icon(icon_type)
-            
-            if icon_source == 'file':
-                # 公式 SVG（簡略版）
-                viewbox_match = re.search(r'viewBox="([^"]+)"', icon_data)
-                if viewbox_match:
-                    vb = viewbox_match.group(1).split()
-                    vb_size = float(vb[2]) if len(vb) >= 3 else 64
-                else:
-                    vb_size = 64
-                
-                inner_match = re.search(r'<svg[^>]*>(.*)</svg>', icon_data, re.DOTALL)
-                inner_content = inner_match.group(1) if inner_match else ''
-                scale = icon_size / vb_size
-                
-                svg_parts.append(f'''    <g transform="translate({x},{y})">
-      <g transform="scale({scale:.4f})">{inner_content}</g>
-    </g>
-''')
-            else:
-                # デフォルトアイコン
-                bg_color = icon_data['bg']
-                paths = icon_data['paths']
-                scale = icon_size / 24
-                
-                path_elements = ''
-                for p in paths:
-                    path_elements += f'<path d="{p}" fill="none" stroke="white" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>'
-                
-                svg_parts.append(f'''    <g transform="translate({x},{y})">
-      <rect x="0" y="0" width="{icon_size}" height="{icon_size}" rx="3" fill="{bg_color}"/>
-      <g transform="scale({scale:.3f})">{path_elements}</g>
-    </g>
-''')
+            symbol_id = self._get_icon_symbol(icon_type, self.ICON_SIZE)
+            append(_LEGEND_ICON % (symbol_id, x, y, icon_size, icon_size))
             
             # サービス名
-            svg_parts.append(f'    <text x="{x + icon_size + 5}" y="{y + icon_size/2 + 4}" fill="#333" font-size="9">{display_name}</text>\n')
+            append(_LEGEND_LABEL % (x + icon_size + 5, y + icon_size // 2 + 4, display_name))
             
             x += item_spacing
         
-        return '\n'.join(svg_parts), x - start_x
+        return svg_parts
     
-    def _build_svg_document(self, content_svg, width, height, used_icon_types):
-        edge_svg = '\n  <!-- Connections -->\n'
-        drawn = set()
-        for source, targets in self.relationships_map.items():
-            for target, rel_type in targets:
-                if (source, target) not in drawn:
-                    edge_svg += self._create_edge_svg(source, target)
-                    drawn.add((source, target))
-        
-        rel_count = sum(len(v) for v in self.relationships_map.values())
+    def _build_svg_document(self, content_parts, width, height, used_icon_types):
+        """ヘッダー、本文の断片、接続線、フッターを書き出し順に並べたリストを返す"""
+        # 種類違いで同じ (source, target) が複数あっても線は 1 本。dict.fromkeys で最初の出現順のまま重複を除く
+        edge_pairs = dict.fromkeys(
+            (source, target)
+            for source, targets in self.relationships_map.items()
+            for target, rel_type in targets
+        )
+        create_edge = self._create_edge_svg
+        edge_parts = [_SVG_EDGES_OPEN]
+        edge_parts.extend(create_edge(source, target) for source, target in edge_pairs)
+        edge_parts.append(_SVG_EDGES_CLOSE)
+        
+        # 凡例を生成（右上に配置）。幅は描画前に求められるので 1 回だけ作る
+        # 凡例もアイコンの <symbol> を参照するため、<defs> の中身より先に作る
+        legend_x = max(300, width - self._legend_width(used_icon_types) - 30)
+        legend_parts = self._create_legend(used_icon_types, legend_x, 25)
+        
+        rel_count = self.rel_count
         grid = self.GRID_SIZE
         grid2 = grid * 2
         
-        # 凡例を生成（右上に配置）
-        legend_svg, legend_width = self._create_legend(used_icon_types, width - 50, 25)
-        # 凡例の幅に応じて図の幅を調整
-        legend_x = max(300, width - legend_width - 30)
-        legend_svg, _ = self._create_legend(used_icon_types, legend_x, 25)
-        
-        return f'''<?xml version="1.0" encoding="UTF-8"?>
-<svg xmlns="http://www.w3.org/2000/svg" 
-     width="{width}" height="{height}" 
-     viewBox="0 0 {width} {height}"
-     style="background-color: white; font-family: Arial, sans-serif;">
-  
-  <defs>
-    <marker id="arrowhead" markerWidth="8" markerHeight="6" refX="7" refY="3" orient="auto">
-      <polygon points="0 0, 8 3, 0 6" fill="#222"/>
-    </marker>
-    <pattern id="smallGrid" width="{grid}" height="{grid}" patternUnits="userSpaceOnUse">
-      <path d="M {grid} 0 L 0 0 0 {grid}" fill="none" stroke="#ddd" stroke-width="0.5"/>
-    </pattern>
-    <pattern id="grid" width="{grid2}" height="{grid2}" patternUnits="userSpaceOnUse">
-      <rect width="{grid2}" height="{grid2}" fill="url(#smallGrid)"/>
-      <path d="M {grid2} 0 L 0 0 0 {grid2}" fill="none" stroke="#bbb" stroke-width="1"/>
-    </pattern>
-  </defs>
-  <rect width="100%" height="100%" fill="url(#grid)"/>
-  
-  <text x="20" y="25" fill="#232F3E" font-size="14" font-weight="bold">AWS Architecture Diagram</text>
-  <text x="20" y="42" fill="#666" font-size="10">VPCs: {len(self.reader.vpcs)} | Subnets: {len(self.reader.subnets)} | Relationships: {rel_count}</text>
+        # <defs> のアイコン <symbol> は連結せず、そのまま断片として並べる
+        svg_parts = [_SVG_HEAD % (width, height, width, height)]
+        svg_parts.extend(self.icon_symbols)
+        svg_parts.append(_SVG_DEFS % {'grid': grid, 'grid2': grid2})
+        svg_parts.append(_SVG_TITLE % (len(self.reader.vpcs), len(self.reader.subnets), rel_count))
+        _append_flat(svg_parts, legend_parts)
+        svg_parts.append('\n\n')
+        if self.subnet_border_paths:
+            svg_parts.append(_SUBNET_BORDERS % (' '.join(self.subnet_border_paths), ''.join(self.subnet_labels)))
+        svg_parts.extend(content_parts)
+        svg_parts.append('\n')
+        svg_parts.extend(edge_parts)
+        svg_parts.append(_SVG_TAIL)
+        return svg_parts
 
-  <!-- Legend -->
-{legend_svg}
 
-{content_svg}
-{edge_svg}
-</svg>'''
+SVGGenerator._compile_icons()